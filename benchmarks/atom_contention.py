@@ -0,0 +1,57 @@
+"""
+Many threads increment one atom with swap!, the final count must equal
+the number of swaps. Unsynchronized read-modify-write is shown for
+comparison.
+
+    python benchmarks/atom_contention.py [threads] [swaps-per-thread]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from mal_types import make_atom, deref, swap  # noqa: E402
+
+
+def increment(value):
+    # some python work between read and write makes switches likely
+    return sum((value, 1))
+
+
+def naive_swap(atom, fn):
+    atom.value = fn(atom.value)
+
+
+def measure(name, swap_fn, threads, swaps):
+    atom = make_atom(0)
+
+    def worker():
+        for _ in range(swaps):
+            swap_fn(atom, increment)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    expected = threads * swaps
+    print(
+        f'{name:<8} {deref(atom)}/{expected} swaps, lost {expected - deref(atom)}, '
+        f'{expected / elapsed:,.0f} swaps/s'
+    )
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    swaps = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    sys.setswitchinterval(1e-6)
+    measure('naive', naive_swap, threads, swaps)
+    measure('swap!', swap, threads, swaps)
+
+
+if __name__ == '__main__':
+    main()
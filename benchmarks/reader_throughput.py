@@ -0,0 +1,44 @@
+"""
+Measures reader throughput in MB/s on a generated multi-megabyte source.
+
+    python benchmarks/reader_throughput.py [size-in-mb]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.setrecursionlimit(100000)
+
+from reader import read_str, tokenize  # noqa: E402
+
+FORM = (
+    '(def! fib ; naive fibonacci\n'
+    '  (fn* [n] (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))\n'
+    '{:name "reader \\"benchmark\\"" :values [1 -2 3.5 nil true false]}\n'
+    "`(a ~b ~@c '@d ^{:meta 1} [x y z])\n"
+)
+
+
+def make_source(size):
+    forms = FORM * (size // len(FORM) + 1)
+    return f'(do {forms})'
+
+
+def measure(name, fn, source):
+    start = time.perf_counter()
+    fn(source)
+    elapsed = time.perf_counter() - start
+    megabytes = len(source.encode('utf-8')) / 2 ** 20
+    print(f'{name:<10} {megabytes:6.1f} MB in {elapsed:6.3f} s, {megabytes / elapsed:6.2f} MB/s')
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2 ** 20) if len(sys.argv) > 1 else 4 * 2 ** 20
+    source = make_source(size)
+    measure('tokenize', lambda text: sum(1 for _ in tokenize(text)), source)
+    measure('read_str', read_str, source)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures startup time of the interpreter: importing it as a library and
+running a one-line script. Exits with status 1, when median of a script
+run is over the budget.
+
+    python benchmarks/startup_time.py [runs] [budget-ms]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+BUDGET_MS = 150
+
+
+def median_ms(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else BUDGET_MS
+    with tempfile.NamedTemporaryFile('w', suffix='.mal', delete=False) as script:
+        script.write('(prn (+ 1 2))\n')
+    try:
+        commands = {
+            'python': [sys.executable, '-c', 'pass'],
+            'import': [sys.executable, '-c', 'import stepA_mal'],
+            'script': [sys.executable, 'stepA_mal.py', script.name],
+        }
+        results = {name: median_ms(command, runs) for name, command in commands.items()}
+    finally:
+        os.unlink(script.name)
+    for name, elapsed in results.items():
+        print(f'{name:<8} {elapsed:7.1f} ms')
+    print(f'budget   {budget:7.1f} ms')
+    if results['script'] > budget:
+        print('script startup is over budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,22 @@
+import mmap
+import os
+import sys
+from contextvars import ContextVar, copy_context
 from copy import copy
+from itertools import chain, count as count_from, islice
+from threading import Lock, Thread
 from time import time
 from operator import (
     add, sub, mul, truediv, lt, le, gt, ge
 )
-from printer import pr_str
-from reader import read_str
+from printer import pr_str, pr_to
+from reader import read_str, read_forms
 from mal_types import (
-    make_list, is_list, NIL, is_empty, count,
+    make_list, is_list, NIL, FALSE, is_empty, count,
     is_iterable, make_symbol, is_symbol,
     make_atom, is_atom, deref, swap, reset,
+    compare_and_set, add_watch, remove_watch,
+    make_promise, deliver, make_future,
     cons, concat, make_vector, is_vector, make_vector_vargs,
     first, rest, nth,
     is_nil, is_true, is_false, make_keyword, is_keyword,
@@ -16,16 +24,27 @@ from mal_types import (
     make_hashmap_vargs, assoc, dissoc, make_string,
     is_string, is_function, is_number, is_mal_function,
     make_hashmap_from_pydict, make_number, can_have_metadata,
+    is_lazy_seq, lazy_seq_from_iterator,
+    MalList, MalVector, MalHashmap, LazySeq,
 )
 
 
+def _write(out, args, print_readably):
+    for index, arg in enumerate(args):
+        if index:
+            out.write(' ')
+        pr_to(out, arg, print_readably)
+
+
 def prn(*args):
-    print(" ".join(pr_str(arg, True) for arg in args))
+    _write(sys.stdout, args, True)
+    sys.stdout.write('\n')
     return NIL
 
 
 def println(*args):
-    print(" ".join(pr_str(arg, False) for arg in args))
+    _write(sys.stdout, args, False)
+    sys.stdout.write('\n')
     return NIL
 
 
@@ -39,25 +58,184 @@ def str_(*args):
     return string
 
 
+_EQUALITY_KINDS = {
+    # list and vector are equal in tests =(
+    MalList: 'sequential',
+    MalVector: 'sequential',
+    LazySeq: 'sequential',
+    MalHashmap: 'hashmap',
+}
+
+
 def equal(op1, op2):
-    if is_iterable(op1) and is_iterable(op2):  # list and vector are equal in tests =(
+    kind = _EQUALITY_KINDS.get(type(op1))
+    if kind != _EQUALITY_KINDS.get(type(op2)):
+        return False
+    if kind == 'sequential':
         if count(op1) != count(op2):
             return False
         return all(
             equal(el1, el2) for (el1, el2) in zip(op1, op2)
         )
-    if is_hashmap(op1) and is_hashmap(op2):
+    if kind == 'hashmap':
         if set(keys(op1)) != set(keys(op2)):
             return False
         return all(equal(op1[key], op2[key]) for key in keys(op1))
     return type(op1) == type(op2) and op1 == op2
 
 
+MMAP_THRESHOLD = 1024 * 1024
+
+# directory, that relative file names are resolved against (client's
+# directory for requests of the evaluation server), None is process cwd
+working_directory = ContextVar('working_directory', default=None)
+
+
+def resolve_path(filename):
+    directory = working_directory.get()
+    if directory is None:
+        return filename
+    return os.path.join(directory, filename)
+
+
+def _read_bytes(filename, decode):
+    """
+    Read file in one go, files larger than MMAP_THRESHOLD are mapped
+    into memory instead of being copied through read buffers. decode
+    gets bytes-like object, that yields ints, in both cases.
+    """
+    with open(resolve_path(filename), 'rb') as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            return decode(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                return decode(view)
+
+
 def slurp(filename):
-    strip_comments = lambda line: line.split(';')[0]
-    with open(filename) as f:
-        contents = ' '.join(strip_comments(line) for line in f if line)
-    return contents
+    return _read_bytes(filename, lambda data: str(data, 'utf-8'))
+
+
+def slurp_bytes(filename):
+    return _read_bytes(filename, make_vector)
+
+
+def pr_to_file(filename, *args):
+    with open(resolve_path(filename), 'w', encoding='utf-8') as f:
+        _write(f, args, True)
+    return NIL
+
+
+def spit(filename, content):
+    with open(resolve_path(filename), 'w', encoding='utf-8') as f:
+        pr_to(f, content, False)
+    return NIL
+
+
+def line_seq(filename):
+    filename = resolve_path(filename)
+
+    def lines():
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\n')
+    return lazy_seq_from_iterator(lines())
+
+
+_event_loop = []
+_event_loop_lock = Lock()
+
+
+def event_loop():
+    """
+    asyncio loop, that runs in a daemon thread, started on first use.
+    asyncio is imported here and in coroutines, not to slow down startup.
+    """
+    import asyncio
+    with _event_loop_lock:
+        if not _event_loop:
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, daemon=True).start()
+            _event_loop.append(loop)
+    return _event_loop[0]
+
+
+def _schedule(coroutine):
+    """
+    Run coroutine on the event loop, return future to await it from mal.
+    """
+    import asyncio
+    task = asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+    return make_future(task.result)
+
+
+async def _in_thread(fn, *args):
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+# the loop doesn't run in context of the caller, paths are resolved before
+def slurp_async(filename):
+    return _schedule(_in_thread(slurp, resolve_path(filename)))
+
+
+def spit_async(filename, content):
+    return _schedule(_in_thread(spit, resolve_path(filename), content))
+
+
+async def _sh(cwd, program, *args):
+    import asyncio
+    process = await asyncio.create_subprocess_exec(
+        program, *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    out, err = await process.communicate()
+    return make_hashmap_vargs(
+        make_keyword('exit'), process.returncode,
+        make_keyword('out'), out.decode('utf-8', 'replace'),
+        make_keyword('err'), err.decode('utf-8', 'replace'),
+    )
+
+
+def sh_async(program, *args):
+    return _schedule(_sh(working_directory.get(), program, *args))
+
+
+async def _sleep(ms):
+    import asyncio
+    await asyncio.sleep(ms / 1000)
+
+
+def sleep_async(ms):
+    return _schedule(_sleep(ms))
+
+
+GO_THREADS = 64
+_go_executor = []
+
+
+def go_call(fn, *args):
+    """
+    Run mal function in a thread, so it can wait for I/O while others run.
+    The function runs in a copy of the caller's context.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with _event_loop_lock:
+        if not _go_executor:
+            _go_executor.append(ThreadPoolExecutor(GO_THREADS))
+    context = copy_context()
+    return make_future(_go_executor[0].submit(context.run, _callable(fn), *args).result)
+
+
+def read_forms_(filename):
+    filename = resolve_path(filename)
+
+    def forms():
+        with open(filename, encoding='utf-8') as f:
+            yield from read_forms(f)
+    return lazy_seq_from_iterator(forms())
 
 
 def mal_readline(prompt):
@@ -67,23 +245,87 @@ def mal_readline(prompt):
         return NIL
 
 
+_SEQ = {
+    MalList: lambda entity: entity,
+    LazySeq: lambda entity: entity,
+    MalVector: make_list,
+    str: make_list,
+}
+
+
 def seq(entity):
-    if (
-        (is_iterable(entity) or is_string(entity))
-        and len(entity)
-    ):
-        return make_list(entity)
-    return NIL
+    to_seq = _SEQ.get(type(entity))
+    if to_seq is None or not entity:
+        return NIL
+    return to_seq(entity)
 
 
 def conj(collection, *args):
-    if is_list(collection):
-        return make_list([*reversed(args), *collection])
+    if is_list(collection) or is_lazy_seq(collection):
+        for arg in args:
+            collection = cons(arg, collection)
+        return collection
     if is_vector(collection):
-        return make_vector([*collection, *args])
+        for arg in args:
+            collection = collection.conj(arg)
+        return collection
     raise TypeError('conj element 1 should be a collection')
 
 
+def _callable(fn):
+    return fn.fn if is_mal_function(fn) else fn
+
+
+def _iterate(collection):
+    return iter(()) if is_nil(collection) else iter(collection)
+
+
+def lazy_map(fn, *collections):
+    return lazy_seq_from_iterator(map(_callable(fn), *map(_iterate, collections)))
+
+
+def lazy_concat(*collections):
+    return lazy_seq_from_iterator(chain.from_iterable(map(_iterate, collections)))
+
+
+def mal_range(*args):
+    if not args:
+        return lazy_seq_from_iterator(count_from())
+    start, end, step = (0, *args, 1)[-3:] if len(args) == 1 else (*args, 1)[:3]
+
+    def numbers():
+        value = start
+        while value < end if step > 0 else value > end:
+            yield value
+            value += step
+    return lazy_seq_from_iterator(numbers())
+
+
+def take(n, collection):
+    return lazy_seq_from_iterator(islice(_iterate(collection), n))
+
+
+def drop(n, collection):
+    return lazy_seq_from_iterator(islice(_iterate(collection), n, None))
+
+
+def mal_filter(predicate, collection):
+    predicate = _callable(predicate)
+
+    def matches(element):
+        result = predicate(element)
+        return result is not NIL and result is not FALSE
+    return lazy_seq_from_iterator(
+        element for element in _iterate(collection) if matches(element)
+    )
+
+
+def doall(collection):
+    for _ in _iterate(collection):
+        pass
+    return collection
+
+
 def py_eval(expression):
     result = eval(expression)
     if isinstance(result, (tuple, list)):
@@ -141,12 +383,28 @@ namespace_ = {
     'empty?': is_empty,
     'count': count,
     'read-string': read_str,
+    'read-forms': read_forms_,
     'slurp': slurp,
+    'slurp-bytes': slurp_bytes,
+    'line-seq': line_seq,
+    'pr-to': pr_to_file,
+    'spit': spit,
     'atom': make_atom,
     'atom?': is_atom,
     'deref': deref,
     'swap!': swap,
     'reset!': reset,
+    'compare-and-set!': lambda atom, old, new: compare_and_set(atom, old, new, equal),
+    'add-watch': add_watch,
+    'remove-watch': remove_watch,
+    'promise': make_promise,
+    'deliver': deliver,
+    'await': deref,
+    'slurp-async': slurp_async,
+    'spit-async': spit_async,
+    'sh-async': sh_async,
+    'sleep-async': sleep_async,
+    'go-call': go_call,
     'cons': cons,
     'concat': concat,
     'vec': make_vector,
@@ -184,6 +442,14 @@ namespace_ = {
     'seq': seq,
     'conj': conj,
     'py-eval': py_eval,
+    'lazy-map': lazy_map,
+    'lazy-concat': lazy_concat,
+    'range': mal_range,
+    'take': take,
+    'drop': drop,
+    'filter': mal_filter,
+    'doall': doall,
+    'lazy-seq?': is_lazy_seq,
 }
 
 namespace = {make_symbol(k): v for k, v in namespace_.items()}
@@ -1,3 +1,5 @@
+from threading import Lock
+from weakref import WeakSet
 from mal_types import (
     make_symbol, make_list, is_symbol, MalException
 )
@@ -6,6 +8,18 @@ from mal_types import (
 VARIADIC_ASSIGNMENT_SYMBOL = make_symbol('&')
 
 
+class _Unbound:
+    """
+    Value of frame slot, that is reserved, but not yet set. It is pickled
+    by reference, so identity survives unpickling.
+    """
+    __slots__ = []
+
+    def __reduce__(self):
+        return 'UNBOUND'
+UNBOUND = _Unbound()  # noqa
+
+
 class Env:
     def __init__(self, outer=None, binds=[], exprs=[]):
         self._scope = {}
@@ -31,6 +45,17 @@ class Env:
             return self._outer.find(name)
         return None
 
+    def lookup(self, name, default=None):
+        """
+        Non-raising version of `get`.
+        """
+        env = self
+        while env is not None:
+            if name in env._scope:
+                return env._scope[name]
+            env = env._outer
+        return default
+
     def get(self, name):
         env = self.find(name)
         if env is None:
@@ -44,3 +69,103 @@ class Env:
         if self._outer is None:
             return str_repr
         return str_repr + '    ' + str(self._outer)
+
+
+class Frame(list):
+    """
+    Array-backed local environment. Symbols are resolved to (depth, slot)
+    addresses before evaluation, so lookup is `outer` hops plus an index.
+    """
+    __slots__ = ['outer']
+
+
+class Cell:
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+
+class GlobalEnv(Env):
+    """
+    Top-level environment. Each binding lives in a Cell, so analyzed code
+    keeps the cell of global symbol and sees rebinding by def! without
+    looking the symbol up again.
+
+    GlobalEnv with `outer` is a child environment: until child defines
+    a name, the name means what it means in outer, also after outer
+    redefines it; def! of child never reach outer. Cells of names, that
+    child has not defined, follow outer: outer sets them, when it
+    redefines the names, so reading a global stays a read of its cell.
+    """
+    _lock = Lock()  # orders creating inherited cells and updating them
+
+    def __init__(self, outer=None):
+        super().__init__(outer)
+        self._inherited = set()
+        self._children = WeakSet()
+        if outer is not None:
+            outer._children.add(self)
+
+    def set(self, name, value):
+        with self._lock:
+            cell = self._scope.get(name)
+            if cell is None:
+                cell = self._scope[name] = Cell(value)
+            self._inherited.discard(name)
+            cell.value = value
+            for child in list(self._children):
+                child._inherit(name, value)
+
+    def _inherit(self, name, value):
+        if name in self._scope and name not in self._inherited:
+            return  # child has defined the name, it hides outer's one
+        cell = self._scope.get(name)
+        if cell is not None:
+            cell.value = value
+        for child in list(self._children):
+            child._inherit(name, value)
+
+    def cell(self, name):
+        cell = self._scope.get(name)
+        if cell is None:
+            with self._lock:
+                cell = self._scope.get(name)
+                if cell is None:
+                    value = UNBOUND
+                    if self._outer is not None:
+                        value = self._outer.lookup(name, UNBOUND)
+                        self._inherited.add(name)
+                    cell = self._scope[name] = Cell(value)
+        return cell
+
+    def find(self, name):
+        cell = self._scope.get(name)
+        if cell is not None and cell.value is not UNBOUND:
+            return self
+        if self._outer is not None:
+            return self._outer.find(name)
+        return None
+
+    def lookup(self, name, default=None):
+        cell = self._scope.get(name)
+        if cell is None or cell.value is UNBOUND:
+            if self._outer is not None:
+                return self._outer.lookup(name, default)
+            return default
+        return cell.value
+
+    def get(self, name):
+        env = self.find(name)
+        if env is None:
+            return super().get(name)
+        return env.lookup(name)
+
+    def bindings(self):
+        for name, cell in self._scope.items():
+            if cell.value is not UNBOUND:
+                yield name, cell.value
+        if self._outer is not None:
+            for name, value in self._outer.bindings():
+                if self.find(name) is not self:
+                    yield name, value
@@ -0,0 +1,56 @@
+"""
+Thin client of `stepA_mal.py --serve`. Sends mal file to the running
+server and prints its output, so scripts don't pay interpreter startup.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f'mal-{os.getuid()}.sock')
+
+
+def connect(socket_path=None):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path or DEFAULT_SOCKET)
+    return client
+
+
+def run(filename, argv, socket_path=None):
+    """
+    Evaluate file on server, print its output. Returns exit code.
+    """
+    if filename == '-':
+        source = sys.stdin.read()
+    else:
+        with open(filename, encoding='utf-8') as file:
+            source = file.read()
+    request = {'source': source, 'filename': filename, 'argv': argv, 'cwd': os.getcwd()}
+    with connect(socket_path) as client:
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        for line in client.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+            if 'exit' in message:
+                if 'error' in message:
+                    print(message['error'])
+                return message['exit']
+    print('Error: connection closed by server', file=sys.stderr)
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', help='Filename to be executed, - for stdin')
+    parser.add_argument('prog_args', nargs='*', help='Arguments passed to program')
+    parser.add_argument('--socket', help=f'Unix socket of server (default {DEFAULT_SOCKET})')
+    args = parser.parse_args()
+    sys.exit(run(args.filename, args.prog_args, args.socket))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Evaluation server of `stepA_mal.py --serve`. Interpreter stays warm
+between requests, each request is evaluated by the interpreter callback
+in its own thread.
+"""
+import atexit
+import json
+import os
+import socketserver
+import sys
+import threading
+from contextvars import ContextVar
+from mal_client import DEFAULT_SOCKET
+from mal_types import MalException
+from printer import pr_str
+
+
+# output stream of the request, that is evaluated in this context
+output_target = ContextVar('output_target', default=None)
+
+
+class ThreadOutput:
+    """
+    sys.stdout, that sends output to the target set in the context, so
+    concurrent requests of the server print to their own clients. Threads
+    of go blocks run in a copy of the request's context and print there too.
+    """
+    def __init__(self, default):
+        self.default = default
+
+    def target(self):
+        return output_target.get() or self.default
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        return self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+class ClientOutput:
+    """
+    Text stream, that sends written text to the client line by line.
+    """
+    def __init__(self, send):
+        self.send = send
+        self.pending = []
+
+    def write(self, text):
+        self.pending.append(text)
+        if '\n' in text:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            self.send(out=''.join(self.pending))
+            self.pending = []
+
+
+class EvalHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one request: a JSON line with `source`, `filename` and `argv`,
+    that is passed to `evaluate` function of the server. Output
+    is sent back as JSON lines `{"out": text}`, the last line is
+    `{"exit": code}` with `error` message, when evaluation failed.
+    """
+    def send(self, **message):
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        output = ClientOutput(self.send)
+        token = output_target.set(output)
+        try:
+            self.server.evaluate(json.loads(self.rfile.readline()))
+        except MalException as e:
+            output.flush()
+            self.send(exit=1, error=f'Error: {pr_str(e)}')
+        except Exception as e:  # compatibility
+            output.flush()
+            self.send(exit=1, error=f'Error: {e}')
+        else:
+            output.flush()
+            self.send(exit=0)
+        finally:
+            output_target.reset(token)
+
+
+class ThreadingMixIn(socketserver.ThreadingMixIn):
+    """
+    Serves each request in a thread made by `start_thread` of the server,
+    so requests get the stack, that the interpreter needs.
+    """
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        self.start_thread(lambda: self.process_request_thread(request, client_address))
+
+
+class UnixEvalServer(ThreadingMixIn, socketserver.UnixStreamServer):
+    def server_bind(self):
+        # requests run arbitrary code as the server user, so only the user
+        # may connect: socket is created with 0600 permissions
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+
+def serve(evaluate, socket_path=None, start_thread=None):
+    """
+    Pass requests of mal_client.py to evaluate, until interrupted.
+    Listens on unix socket, requests are served in threads started by
+    `start_thread(target)`.
+    """
+    socket_path = socket_path or DEFAULT_SOCKET
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = UnixEvalServer(socket_path, EvalHandler)
+    server.evaluate = evaluate
+    server.start_thread = start_thread or start_daemon_thread
+    sys.stdout = ThreadOutput(sys.stdout)
+
+    def close():
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    # serve may run in a daemon thread, that is stopped without finally
+    atexit.register(close)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close()
+
+
+def start_daemon_thread(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
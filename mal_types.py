@@ -1,4 +1,9 @@
 from copy import copy
+from itertools import islice
+from operator import is_
+from threading import Event, Lock
+from zlib import crc32
+from persistent import PersistentList, PersistentVector, PersistentHashMap
 
 # atomic types
 NIL = None
@@ -20,8 +25,39 @@ def make_number(str_):
         return float(str_)
 is_number = lambda entity: isinstance(entity, (int, float)) and not is_bool(entity)
 
-make_keyword = lambda str_: str_ if is_keyword(str_) else u"\u029e" + str(str_.lstrip(':'))
-is_keyword = lambda entity: isinstance(entity, str) and entity.startswith(u"\u029e")
+
+class Keyword:
+    """
+    Interned keyword: keywords with the same name are the same object,
+    so they are compared by identity. Hash is computed from the name once,
+    so it is the same in every run.
+    """
+    __slots__ = ['name', '_hash']
+    _interned = {}
+
+    def __new__(cls, name):
+        keyword = cls._interned.get(name)
+        if keyword is None:
+            keyword = super().__new__(cls)
+            keyword.name = name
+            keyword._hash = crc32(f':{name}'.encode('utf-8', 'surrogatepass'))
+            # setdefault is atomic, threads racing to intern get one keyword
+            keyword = cls._interned.setdefault(name, keyword)
+        return keyword
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return Keyword, (self.name,)
+
+    def __copy__(self):
+        return self
+
+    def __repr__(self):
+        return f'Keyword({self.name!r})'
+make_keyword = lambda str_: str_ if is_keyword(str_) else Keyword(str(str_.lstrip(':')))  # noqa
+is_keyword = lambda entity: type(entity) is Keyword
 
 def make_string(str_):  # noqa
     return (
@@ -31,7 +67,7 @@ def make_string(str_):  # noqa
         .replace('\\"', '"')
         .replace(u'\u029e', '\\')
     )
-is_string = lambda entity: isinstance(entity, str) and not is_keyword(entity)  # noqa
+is_string = lambda entity: isinstance(entity, str)  # noqa
 
 make_symbol = lambda str_: bytes(str_, encoding='utf-8')
 is_symbol = lambda entity: isinstance(entity, bytes)
@@ -43,16 +79,16 @@ can_have_metadata = lambda entity: isinstance(entity, MalWithMetaMixin) or is_fu
 
 
 # compound types
-class MalList(list, MalWithMetaMixin): pass  # noqa
+class MalList(PersistentList, MalWithMetaMixin): pass  # noqa
 make_list = lambda entity: MalList(entity)  # noqa
-is_list = lambda entity: isinstance(entity, MalList) and not is_atom(entity)
+is_list = lambda entity: isinstance(entity, MalList)
 
-class MalVector(tuple, MalWithMetaMixin): pass  # noqa
+class MalVector(PersistentVector, MalWithMetaMixin): pass  # noqa
 make_vector = lambda entity: MalVector(entity)  # noqa
 make_vector_vargs = lambda *args: make_vector(args)
 is_vector = lambda entity: isinstance(entity, MalVector)
 
-class MalHashmap(dict, MalWithMetaMixin): pass  # noqa
+class MalHashmap(PersistentHashMap, MalWithMetaMixin): pass  # noqa
 make_hashmap = lambda iterable: MalHashmap(zip(iterable[0::2], iterable[1::2]))  # noqa
 make_hashmap_vargs = lambda *args: make_hashmap(args)
 make_hashmap_from_pydict = lambda x: MalHashmap(x)
@@ -60,65 +96,262 @@ is_hashmap = lambda entity: isinstance(entity, MalHashmap)
 keys = lambda entity: make_list(entity.keys())
 values = lambda entity: make_list(entity.values())
 get = lambda entity, key: entity.get(key, NIL) if is_hashmap(entity) else NIL
-contains = lambda hashmap, key: key in hashmap.keys()
+contains = lambda hashmap, key: key in hashmap
 def assoc(hashmap, *items):  # noqa
-    return make_hashmap_from_pydict({**hashmap, **{k: v for k, v in zip(items[0::2], items[1::2])}})
+    if is_vector(hashmap):
+        for index, value in zip(items[0::2], items[1::2]):
+            hashmap = hashmap.assoc_n(index, value)
+        return hashmap
+    for key, value in zip(items[0::2], items[1::2]):
+        hashmap = hashmap.assoc(key, value)
+    return hashmap
 def dissoc(hashmap, *items):  # noqa
-    return make_hashmap_from_pydict({k: v for k, v in hashmap.items() if k not in items})
+    for key in items:
+        hashmap = hashmap.dissoc(key)
+    return hashmap
+
+
+
+class LazySeq(MalWithMetaMixin):
+    """
+    Sequence, that calls `thunk` on first access and caches the result.
+    Thunk returns nil, list, vector or another lazy sequence.
+    """
+    def __init__(self, thunk):
+        self._thunk = thunk
+        self._empty = False
+        self._first = NIL
+        self._rest = NIL
+
+    @classmethod
+    def cell(cls, first, rest):
+        seq = cls(None)
+        seq._first = first
+        seq._rest = rest
+        return seq
+
+    def _realize(self):
+        pending = []
+        seq = self
+        # lazy sequence returning lazy sequence is unwrapped without recursion
+        while type(seq) is LazySeq and seq._thunk is not None:
+            pending.append(seq)
+            seq = seq._thunk()
+        if type(seq) is LazySeq:
+            state = seq._empty, seq._first, seq._rest
+        elif is_nil(seq) or not seq:
+            state = True, NIL, NIL
+        else:
+            seq = make_list(seq) if is_string(seq) else seq
+            state = False, first(seq), rest(seq)
+        for lazy in pending:
+            lazy._empty, lazy._first, lazy._rest = state
+            lazy._thunk = None
+
+    def __bool__(self):
+        self._realize()
+        return not self._empty
+
+    def __iter__(self):
+        seq = self
+        del self  # don't keep the head of consumed sequence
+        while type(seq) is LazySeq:
+            seq._realize()
+            if seq._empty:
+                return
+            yield seq._first
+            seq = seq._rest
+        yield from seq
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, index):
+        for element in islice(self, index, None):
+            return element
+        raise IndexError('lazy sequence index out of range')
+
+    def __copy__(self):
+        self._realize()
+        seq = LazySeq.cell(self._first, self._rest)
+        seq._empty = self._empty
+        return seq
+make_lazy_seq = LazySeq
+is_lazy_seq = lambda entity: isinstance(entity, LazySeq)
 
 
+def lazy_seq_from_iterator(iterator):
+    def thunk():
+        for value in iterator:
+            return LazySeq.cell(value, lazy_seq_from_iterator(iterator))
+        return NIL
+    return LazySeq(thunk)
+
 class function(MalWithMetaMixin):
-    __slots__ = ['ast', 'params', 'env', 'fn', 'is_macro', 'meta']
+    __slots__ = ['ast', 'params', 'env', 'fn', 'is_macro', 'meta', 'body', 'layout']
 
     def __copy__(self):
         copy_fn = function(
             copy(self.ast),
             copy(self.params),
-            copy(self.env),
+            self.env,
             copy(self.fn),
             copy(self.is_macro),
+            self.body,
         )
         copy_fn.meta = copy(self.meta)
+        copy_fn.layout = self.layout
         return copy_fn
 
-    def __init__(self, ast, params, env, fn, is_macro=False):
+    def __init__(self, ast, params, env, fn, is_macro=False, body=None):
         self.ast = ast
         self.params = params
         self.env = env
         self.fn = fn
         self.is_macro = is_macro
         self.meta = NIL
+        self.body = body  # analyzed ast, set by evaluators that compile function bodies
+        self.layout = None  # names of enclosing frames, needed to compile body again
 make_function = function  # noqa
 is_mal_function = lambda entity: isinstance(entity, function)
 is_function = lambda entity: callable(entity) or is_mal_function(entity)
 
-_atom_mark = 'atom'
-atom = lambda value: make_list([_atom_mark, value])
+
+class Atom:
+    """
+    Mutable reference. Value is replaced only by compare_and_set under
+    the lock of the atom, so concurrent swaps retry instead of losing
+    updates. Watches are called after every change.
+    """
+    __slots__ = ['value', 'watches', '_lock']
+
+    def __init__(self, value):
+        self.value = value
+        self.watches = {}
+        self._lock = Lock()
+
+    def compare_and_set(self, old, new, matches=is_):
+        with self._lock:
+            if not matches(self.value, old):
+                return False
+            old, self.value = self.value, new
+        self._notify(old, new)
+        return True
+
+    def reset(self, new):
+        with self._lock:
+            old, self.value = self.value, new
+        self._notify(old, new)
+        return new
+
+    def swap(self, fn, *args):
+        while True:
+            old = self.value
+            new = fn(old, *args)
+            if self.compare_and_set(old, new):
+                return new
+
+    def _notify(self, old, new):
+        for key, watch in list(self.watches.items()):
+            _python_callable(watch)(key, self, old, new)
+
+    def __reduce__(self):
+        return Atom, (self.value,), self.watches
+
+    def __setstate__(self, watches):
+        self.watches = dict(watches)
+atom = Atom  # noqa
 make_atom = atom
-is_atom = lambda entity: isinstance(entity, list) and len(entity) == 2 and entity[0] == _atom_mark
+is_atom = lambda entity: type(entity) is Atom
+
+
+class Future:
+    """
+    Result of computation, that runs elsewhere. `result` blocks until
+    the value is ready.
+    """
+    __slots__ = ['result']
+
+    def __init__(self, result):
+        self.result = result
+make_future = Future
+is_future = lambda entity: type(entity) is Future
+
+
+class Promise:
+    """
+    Value, that is delivered once by some thread and awaited by others.
+    """
+    __slots__ = ['value', '_delivered', '_lock']
+
+    def __init__(self):
+        self.value = NIL
+        self._delivered = Event()
+        self._lock = Lock()
+
+    def deliver(self, value):
+        with self._lock:
+            if self._delivered.is_set():
+                return NIL
+            self.value = value
+            self._delivered.set()
+        return self
+
+    def result(self):
+        self._delivered.wait()
+        return self.value
+make_promise = Promise
+is_promise = lambda entity: type(entity) is Promise
 
 
 def deref(entity):
     if is_atom(entity):
-        return entity[1]
+        return entity.value
+    if is_future(entity) or is_promise(entity):
+        return entity.result()
     return NIL
 
 
+def deliver(promise, value):
+    if not is_promise(promise):
+        raise TypeError('deliver first argument should be promise')
+    return promise.deliver(value)
+
+
 def reset(entity, value):
     if is_atom(entity):
-        entity[1] = value
-        return value
+        return entity.reset(value)
     return NIL
 
 
+def _python_callable(fn):
+    return fn.fn if is_mal_function(fn) else fn
+
+
 def swap(entity, fn, *args):
     if not is_atom(entity):
         raise TypeError('swap! first argument should be atom')
-    if is_mal_function(fn):
-        fn = fn.fn
-    new_value = fn(entity[1], *args)
-    entity[1] = new_value
-    return new_value
+    return entity.swap(_python_callable(fn), *args)
+
+
+def compare_and_set(entity, old, new, matches=is_):
+    if not is_atom(entity):
+        raise TypeError('compare-and-set! first argument should be atom')
+    return entity.compare_and_set(old, new, matches)
+
+
+def add_watch(entity, key, fn):
+    if not is_atom(entity):
+        raise TypeError('add-watch first argument should be atom')
+    entity.watches[key] = fn
+    return entity
+
+
+def remove_watch(entity, key):
+    if not is_atom(entity):
+        raise TypeError('remove-watch first argument should be atom')
+    entity.watches.pop(key, None)
+    return entity
 
 
 def items(entity):
@@ -127,7 +360,9 @@ def items(entity):
     raise TypeError
 
 
-is_iterable = lambda entity: any(is_a(entity) for is_a in (is_list, is_vector))
+# dispatch on type(entity) is a single lookup, mal never subclasses these types
+SEQUENTIAL_TYPES = frozenset((MalList, MalVector, LazySeq))
+is_iterable = lambda entity: type(entity) in SEQUENTIAL_TYPES
 
 
 def is_empty(entity):
@@ -149,8 +384,12 @@ def first(entity):
 
 
 def rest(entity):
+    if is_list(entity):
+        return entity.rest
+    if is_lazy_seq(entity):
+        return entity._rest if entity else make_list([])
     if is_iterable(entity) and entity:
-        return make_list(entity[1:])
+        return make_list(islice(entity, 1, None))
     return make_list([])
 
 
@@ -164,20 +403,30 @@ def nth(entity, n):
 
 
 def count(entity):
-    if is_iterable(entity):
+    if type(entity) in SEQUENTIAL_TYPES:
         return len(entity)
     return 0
 
 
 def cons(element, sequence):
+    if is_list(sequence):
+        return sequence.cons(element)
+    if is_lazy_seq(sequence):
+        return LazySeq.cell(element, sequence)
     return make_list([element, *sequence])
 
 
 def concat(*sequences):
-    joined = []
-    for sequence in sequences:
-        joined += sequence
-    return make_list(joined)
+    if not sequences:
+        return make_list([])
+    *heads, joined = sequences
+    if not is_list(joined):
+        joined = make_list(joined)
+    # last sequence becomes shared tail of the result
+    for sequence in reversed(heads):
+        for element in reversed(list(sequence)):
+            joined = joined.cons(element)
+    return joined
 
 
 def init_save_value(self, value):
@@ -0,0 +1,495 @@
+"""
+Persistent (immutable, structurally shared) collections used by mal types.
+"""
+from zlib import crc32
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+class PersistentVector:
+    """
+    Clojure-style vector: 32-way trie of python lists plus a tail list.
+    nth, conj and assoc_n are O(log32 n), updated versions share all
+    untouched nodes with the original.
+    """
+    __slots__ = ['_count', '_shift', '_root', '_tail', '_hash']
+
+    def __init__(self, items=()):
+        items = list(items)
+        count = len(items)
+        tail_offset = ((count - 1) >> BITS) << BITS if count else 0
+        nodes = [items[i:i + WIDTH] for i in range(0, tail_offset, WIDTH)]
+        shift = BITS
+        while len(nodes) > WIDTH:
+            nodes = [nodes[i:i + WIDTH] for i in range(0, len(nodes), WIDTH)]
+            shift += BITS
+        self._init(count, shift, nodes, items[tail_offset:])
+
+    def _init(self, count, shift, root, tail):
+        self._count = count
+        self._shift = shift
+        self._root = root
+        self._tail = tail
+        self._hash = None
+
+    def _make(self, count, shift, root, tail):
+        vector = self.__class__.__new__(self.__class__)
+        vector._init(count, shift, root, tail)
+        return vector
+
+    def _tail_offset(self):
+        if self._count < WIDTH:
+            return 0
+        return ((self._count - 1) >> BITS) << BITS
+
+    def _leaf_for(self, index):
+        if index >= self._tail_offset():
+            return self._tail
+        node = self._root
+        for level in range(self._shift, 0, -BITS):
+            node = node[(index >> level) & MASK]
+        return node
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('vector index out of range')
+        return self._leaf_for(index)[index & MASK]
+
+    def __iter__(self):
+        yield from self._iter_node(self._root, self._shift)
+        yield from self._tail
+
+    def _iter_node(self, node, level):
+        if level == 0:
+            yield from node
+            return
+        for child in node:
+            yield from self._iter_node(child, level - BITS)
+
+    def __eq__(self, other):
+        if not isinstance(other, PersistentVector):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(tuple(map(stable_hash, self)))
+        return self._hash
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({list(self)!r})'
+
+    def __copy__(self):
+        vector = self._make(self._count, self._shift, self._root, self._tail)
+        if hasattr(self, '__dict__'):
+            vector.__dict__.update(self.__dict__)
+        return vector
+
+    def __reduce__(self):
+        return self.__class__, (list(self),), getattr(self, '__dict__', None) or None
+
+    def conj(self, value):
+        count = self._count
+        if count - self._tail_offset() < WIDTH:
+            return self._make(count + 1, self._shift, self._root, self._tail + [value])
+        shift = self._shift
+        if (count >> BITS) > (1 << shift):
+            root = [self._root, _new_path(shift, self._tail)]
+            shift += BITS
+        else:
+            root = self._push_tail(shift, self._root, self._tail)
+        return self._make(count + 1, shift, root, [value])
+
+    def _push_tail(self, level, parent, tail):
+        subindex = ((self._count - 1) >> level) & MASK
+        node = list(parent)
+        if level == BITS:
+            child = tail
+        elif subindex < len(parent):
+            child = self._push_tail(level - BITS, parent[subindex], tail)
+        else:
+            child = _new_path(level - BITS, tail)
+        if subindex == len(node):
+            node.append(child)
+        else:
+            node[subindex] = child
+        return node
+
+    def assoc_n(self, index, value):
+        if index == self._count:
+            return self.conj(value)
+        if not 0 <= index < self._count:
+            raise IndexError('vector index out of range')
+        if index >= self._tail_offset():
+            tail = list(self._tail)
+            tail[index & MASK] = value
+            return self._make(self._count, self._shift, self._root, tail)
+        root = _assoc_node(self._shift, self._root, index, value)
+        return self._make(self._count, self._shift, root, self._tail)
+
+
+def _new_path(level, node):
+    while level:
+        node = [node]
+        level -= BITS
+    return node
+
+
+def _assoc_node(level, node, index, value):
+    node = list(node)
+    if level == 0:
+        node[index & MASK] = value
+    else:
+        subindex = (index >> level) & MASK
+        node[subindex] = _assoc_node(level - BITS, node[subindex], index, value)
+    return node
+
+
+
+class PersistentList:
+    """
+    Immutable singly linked list of cons cells. first, rest and cons are
+    O(1) and share the tail, count is stored in every cell. nth walks the
+    cells, so it is O(n).
+    """
+    __slots__ = ['_first', '_rest', '_count', '_hash']
+
+    def __init__(self, items=()):
+        if not isinstance(items, (list, tuple)):
+            items = list(items)
+        cell = self._make(None, None, 0)
+        for item in reversed(items[1:]):
+            cell = cell.cons(item)
+        if items:
+            self._init(items[0], cell, cell._count + 1)
+        else:
+            self._init(None, None, 0)
+
+    def _init(self, first, rest, count):
+        self._first = first
+        self._rest = rest
+        self._count = count
+        self._hash = None
+
+    def _make(self, first, rest, count):
+        cell = self.__class__.__new__(self.__class__)
+        cell._init(first, rest, count)
+        return cell
+
+    @property
+    def first(self):
+        return self._first
+
+    @property
+    def rest(self):
+        if self._rest is None:
+            return self._make(None, None, 0)
+        return self._rest
+
+    def cons(self, value):
+        return self._make(value, self, self._count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        cell = self
+        while cell._count:
+            yield cell._first
+            cell = cell._rest
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('list index out of range')
+        cell = self
+        for _ in range(index):
+            cell = cell._rest
+        return cell._first
+
+    def __eq__(self, other):
+        if not isinstance(other, (PersistentList, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(tuple(map(stable_hash, self)))
+        return self._hash
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({list(self)!r})'
+
+    def __copy__(self):
+        cell = self._make(self._first, self._rest, self._count)
+        if hasattr(self, '__dict__'):
+            cell.__dict__.update(self.__dict__)
+        return cell
+
+    def __reduce__(self):
+        return self.__class__, (list(self),), getattr(self, '__dict__', None) or None
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ['hash', 'key', 'value']
+
+    def __init__(self, hash_, key, value):
+        self.hash = hash_
+        self.key = key
+        self.value = value
+
+
+class _BitmapNode:
+    """
+    HAMT node: `array` holds entries and child nodes for set bits of `bitmap`.
+    """
+    __slots__ = ['bitmap', 'array']
+
+    def __init__(self, bitmap, array):
+        self.bitmap = bitmap
+        self.array = array
+
+    def find(self, shift, hash_, key):
+        bit = 1 << ((hash_ >> shift) & MASK)
+        if not self.bitmap & bit:
+            return _MISSING
+        item = self.array[(self.bitmap & (bit - 1)).bit_count()]
+        if type(item) is _Entry:
+            if item.hash == hash_ and item.key == key:
+                return item.value
+            return _MISSING
+        return item.find(shift + BITS, hash_, key)
+
+    def assoc(self, shift, entry):
+        """
+        Return (node, added), added is False when existing key is replaced.
+        """
+        bit = 1 << ((entry.hash >> shift) & MASK)
+        index = (self.bitmap & (bit - 1)).bit_count()
+        array = list(self.array)
+        if not self.bitmap & bit:
+            array.insert(index, entry)
+            return _BitmapNode(self.bitmap | bit, array), True
+        item = array[index]
+        if type(item) is _Entry:
+            if item.hash == entry.hash and item.key == entry.key:
+                array[index] = entry
+                return _BitmapNode(self.bitmap, array), False
+            array[index] = _merge(shift + BITS, item, entry)
+            return _BitmapNode(self.bitmap, array), True
+        array[index], added = item.assoc(shift + BITS, entry)
+        return _BitmapNode(self.bitmap, array), added
+
+    def dissoc(self, shift, hash_, key):
+        """
+        Return node without key, None if node became empty.
+        """
+        bit = 1 << ((hash_ >> shift) & MASK)
+        if not self.bitmap & bit:
+            return self
+        index = (self.bitmap & (bit - 1)).bit_count()
+        item = self.array[index]
+        if type(item) is _Entry:
+            if item.hash != hash_ or item.key != key:
+                return self
+            child = None
+        else:
+            child = item.dissoc(shift + BITS, hash_, key)
+            if child is item:
+                return self
+        array = list(self.array)
+        if child is not None:
+            array[index] = child
+            return _BitmapNode(self.bitmap, array)
+        del array[index]
+        if not array:
+            return None
+        return _BitmapNode(self.bitmap & ~bit, array)
+
+    def entries(self):
+        for item in self.array:
+            if type(item) is _Entry:
+                yield item
+            else:
+                yield from item.entries()
+
+
+class _CollisionNode:
+    """
+    Entries with equal hashes of different keys.
+    """
+    __slots__ = ['hash', 'array']
+
+    def __init__(self, hash_, array):
+        self.hash = hash_
+        self.array = array
+
+    def find(self, shift, hash_, key):
+        for entry in self.array:
+            if entry.key == key:
+                return entry.value
+        return _MISSING
+
+    def assoc(self, shift, entry):
+        if entry.hash != self.hash:
+            node = _BitmapNode(1 << ((self.hash >> shift) & MASK), [self])
+            return node.assoc(shift, entry)
+        array = [item for item in self.array if item.key != entry.key]
+        added = len(array) == len(self.array)
+        array.append(entry)
+        return _CollisionNode(self.hash, array), added
+
+    def dissoc(self, shift, hash_, key):
+        array = [item for item in self.array if item.key != key]
+        if len(array) == len(self.array):
+            return self
+        if not array:
+            return None
+        return _CollisionNode(self.hash, array)
+
+    def entries(self):
+        return iter(self.array)
+
+
+def _merge(shift, entry1, entry2):
+    if entry1.hash == entry2.hash:
+        return _CollisionNode(entry1.hash, [entry1, entry2])
+    node = _BitmapNode(0, [])
+    node, _ = node.assoc(shift, entry1)
+    node, _ = node.assoc(shift, entry2)
+    return node
+
+
+_EMPTY_NODE = _BitmapNode(0, [])
+
+
+class PersistentHashMap:
+    """
+    Hash array mapped trie. assoc, dissoc and lookup are O(log32 n),
+    updated versions share untouched nodes with the original. Iteration
+    order is the order of stable hashes in the trie, same in every run.
+    """
+    __slots__ = ['_count', '_root', '_hash']
+
+    def __init__(self, items=()):
+        if hasattr(items, 'items'):
+            items = items.items()
+        self._init(0, _EMPTY_NODE)
+        for key, value in items:
+            self._count, self._root = self._assoc(key, value)
+
+    def _init(self, count, root):
+        self._count = count
+        self._root = root
+        self._hash = None
+
+    def _make(self, count, root):
+        hashmap = self.__class__.__new__(self.__class__)
+        hashmap._init(count, root)
+        return hashmap
+
+    def _assoc(self, key, value):
+        root, added = self._root.assoc(0, _Entry(_hash32(key), key, value))
+        return self._count + added, root
+
+    def assoc(self, key, value):
+        return self._make(*self._assoc(key, value))
+
+    def dissoc(self, key):
+        root = self._root.dissoc(0, _hash32(key), key)
+        if root is self._root:
+            return self
+        if root is None:
+            return self._make(0, _EMPTY_NODE)
+        return self._make(self._count - 1, root)
+
+    def get(self, key, default=None):
+        value = self._root.find(0, _hash32(key), key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        value = self._root.find(0, _hash32(key), key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._root.find(0, _hash32(key), key) is not _MISSING
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        return (entry.key for entry in self._root.entries())
+
+    def values(self):
+        return (entry.value for entry in self._root.entries())
+
+    def items(self):
+        return ((entry.key, entry.value) for entry in self._root.entries())
+
+    def __eq__(self, other):
+        if not isinstance(other, PersistentHashMap):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            other.get(key, _MISSING) == value for key, value in self.items()
+        )
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(
+                (stable_hash(key), stable_hash(value)) for key, value in self.items()
+            ))
+        return self._hash
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self.items())!r})'
+
+    def __copy__(self):
+        hashmap = self._make(self._count, self._root)
+        if hasattr(self, '__dict__'):
+            hashmap.__dict__.update(self.__dict__)
+        return hashmap
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()),), getattr(self, '__dict__', None) or None
+
+
+def stable_hash(value):
+    """
+    Hash, that is the same in every run, so hash maps iterate in the same
+    order: python salts hashes of str and bytes per process and hashes
+    None by its address.
+    """
+    kind = type(value)
+    if kind is str:
+        return crc32(value.encode('utf-8', 'surrogatepass'))
+    elif kind is bytes:
+        return crc32(value)
+    elif value is None:
+        return 0
+    return hash(value)
+
+
+def _hash32(key):
+    return stable_hash(key) & 0xFFFFFFFF
@@ -1,56 +1,115 @@
+from itertools import chain
+from types import BuiltinFunctionType, FunctionType
 from mal_types import (
-    is_number,
-    is_symbol,
-    is_string,
-    is_keyword,
+    MalList,
+    MalVector,
+    MalHashmap,
+    LazySeq,
+    function,
     is_function,
-    is_list,
-    is_vector,
-    is_hashmap,
-    is_atom,
-    deref,
-    is_nil,
-    is_bool,
-    TRUE,
-    FALSE,
+    Keyword,
+    Atom,
+    Future,
+    Promise,
+    NIL,
     MalException,
 )
 
 
 def pr_str(entity, print_readably=True):
+    pieces = []
+    _print(entity, print_readably, pieces.append)
+    return ''.join(pieces)
+
+
+BUFFER_SIZE = 4096
+
+
+def pr_to(out, entity, print_readably=True):
+    """
+    Write printed entity to file-like `out` by buffered pieces,
+    without building the whole string.
+    """
+    pieces = []
+
+    def write(piece):
+        pieces.append(piece)
+        if len(pieces) == BUFFER_SIZE:
+            out.write(''.join(pieces))
+            pieces.clear()
+
+    _print(entity, print_readably, write)
+    out.write(''.join(pieces))
+
+
+_END = object()
+
+
+def _print(entity, print_readably, write):
+    """
+    Pass printed entity to `write` by pieces. Nested collections are kept
+    on explicit stack of [elements, closing, is_started] frames.
+    """
+    stack = []
+    while True:
+        printer = _PRINTERS.get(type(entity), _pr_other)
+        if type(printer) is tuple:
+            opening, elements, closing = printer
+            write(opening)
+            stack.append([elements(entity), closing, False])
+        else:
+            write(printer(entity, print_readably))
+        while stack:
+            frame = stack[-1]
+            entity = next(frame[0], _END)
+            if entity is not _END:
+                if frame[2]:
+                    write(' ')
+                frame[2] = True
+                break
+            stack.pop()
+            write(frame[1])
+        else:
+            return
+
+
+def _pr_str(entity, print_readably):
+    if print_readably:
+        return '"' + entity.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return entity
+
+
+def _pr_atom(entity, print_readably):
+    return f'(atom {pr_str(entity.value, print_readably)})'
+
+
+# collections are (opening, elements, closing), other types are printed at once
+_PRINTERS = {
+    MalList: ('(', iter, ')'),
+    LazySeq: ('(', iter, ')'),
+    MalVector: ('[', iter, ']'),
+    MalHashmap: ('{', lambda entity: chain.from_iterable(entity.items()), '}'),
+    type(NIL): lambda entity, print_readably: 'nil',
+    bool: lambda entity, print_readably: 'true' if entity else 'false',
+    int: lambda entity, print_readably: str(entity),
+    float: lambda entity, print_readably: str(entity),
+    bytes: lambda entity, print_readably: str(entity, 'utf-8'),
+    str: _pr_str,
+    Keyword: lambda entity, print_readably: ':' + entity.name,
+    Atom: _pr_atom,
+    Future: lambda entity, print_readably: '#future',
+    Promise: lambda entity, print_readably: '#promise',
+    function: lambda entity, print_readably: '#function',
+    FunctionType: lambda entity, print_readably: '#function',
+    BuiltinFunctionType: lambda entity, print_readably: '#function',
+}
+
+
+def _pr_other(entity, print_readably):
     if isinstance(entity, MalException):
         return f'{pr_str(entity.value)}'
     if isinstance(entity, Exception):
         return entity.args[0]
     elif is_function(entity):
         return '#function'
-    elif is_nil(entity):
-        return 'nil'
-    elif is_bool(entity):
-        return {
-            TRUE: 'true',
-            FALSE: 'false',
-        }[entity]
-    elif is_number(entity):
-        return str(entity)
-    elif is_symbol(entity):
-        return str(entity, 'utf-8')
-    elif is_keyword(entity):
-        return ':' + entity[1:]
-    elif is_string(entity):
-        if print_readably:
-            return '"' + entity.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
-        return entity
-    elif is_atom(entity):
-        return f'(atom {deref(entity)})'
-    elif is_list(entity):
-        return '(' + ' '.join(pr_str(inner, print_readably) for inner in entity) + ')'
-    elif is_vector(entity):
-        return '[' + ' '.join(pr_str(inner, print_readably) for inner in entity) + ']'
-    elif is_hashmap(entity):
-        return (
-            '{'
-            + ' '.join(f'{pr_str(k, print_readably)} {pr_str(v, print_readably)}' for k, v in entity.items())
-            + '}'
-        )
     raise RuntimeError(f'pr_str: unknown type {type(entity)}')
@@ -1,6 +1,7 @@
+import os
+import pickle
 import re
 from mal_types import (
-    make_number,
     make_symbol,
     make_string,
     make_list,
@@ -15,25 +16,25 @@ from mal_types import (
 
 
 class Reader:
-    def __init__(self, tokens, position=0):
-        self._tokens = list(tokens)
-        self._position = position
-        self._iter = tokens
-
-    def _check_position(self):
-        if self._position >= len(self._tokens):
-            raise MalException('EOF')
+    def __init__(self, tokens):
+        self._tokens = iter(tokens)
+        self._token = next(self._tokens, None)
 
     def peek(self):
-        self._check_position()
-        return self._tokens[self._position]
+        if self._token is None:
+            raise MalException('EOF')
+        return self._token
 
     def next(self):
-        self._check_position()
-        token = self.peek()
-        self._position += 1
+        token = self._token
+        if token is None:
+            raise MalException('EOF')
+        self._token = next(self._tokens, None)
         return token
 
+    def at_end(self):
+        return self._token is None
+
 
 def read_str(arg):
     tokens = tokenize(arg)
@@ -41,86 +42,228 @@ def read_str(arg):
     return read_form(reader)
 
 
+CHUNK_SIZE = 64 * 1024
+
+
+def read_forms(source, chunk_size=CHUNK_SIZE):
+    """
+    Generate top-level forms of a string, a file object or an iterable of
+    string chunks. Source is read by chunks, so only the form being read
+    is kept in memory.
+    """
+    if isinstance(source, str):
+        chunks = (source,)
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunk_size), '')
+    else:
+        chunks = source
+    reader = Reader(tokenize_chunks(chunks))
+    while not reader.at_end():
+        yield read_form(reader)
+
+
+# bump, when reader or pickled representation of mal types changes
+CACHE_VERSION = 2
+CACHE_SUFFIX = 'c'
+CACHE_BATCH = 256
+
+
+def read_file(filename):
+    """
+    Generate forms of the file. Parsed forms are cached in `<filename>c`
+    and reused, while size and modification time of the file are the same.
+    """
+    stat = os.stat(filename)
+    header = ('malc', CACHE_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    cache_name = filename + CACHE_SUFFIX
+    try:
+        cache = open(cache_name, 'rb')
+    except OSError:
+        cache = None
+    if cache is not None:
+        with cache:
+            try:
+                is_valid = _is_trusted(cache) and _CacheUnpickler(cache).load() == header
+            except Exception:
+                is_valid = False
+            if is_valid:
+                yield from _load_forms(cache)
+                return
+    yield from _read_and_cache(filename, cache_name, header)
+
+
+def _is_trusted(cache):
+    """
+    Cache is unpickled, so only file of the user, that others can't
+    write, is used: a cache planted in a shared directory is ignored.
+    """
+    stat = os.fstat(cache.fileno())
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+class _CacheUnpickler(pickle.Unpickler):
+    """
+    Unpickler of cached forms, it loads mal data types and nothing else.
+    """
+    ALLOWED = {
+        ('mal_types', 'MalList'),
+        ('mal_types', 'MalVector'),
+        ('mal_types', 'MalHashmap'),
+        ('mal_types', 'Keyword'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f'{module}.{name} is not allowed in cache')
+        return super().find_class(module, name)
+
+
+def _load_forms(cache):
+    while True:
+        try:
+            batch = _CacheUnpickler(cache).load()
+        except EOFError:
+            return
+        yield from batch
+
+
+def _read_and_cache(filename, cache_name, header):
+    import tempfile  # only files without cache need it, keeps startup fast
+    with open(filename, encoding='utf-8') as source:
+        try:
+            cache = tempfile.NamedTemporaryFile(
+                'wb', dir=os.path.dirname(cache_name) or '.', delete=False,
+            )
+        except OSError:
+            yield from read_forms(source)
+            return
+        # forms are pickled by batches, so cache is written without
+        # keeping the whole file in memory; it is published only when
+        # the file is read completely
+        is_complete = False
+        try:
+            with cache:
+                pickle.dump(header, cache, pickle.HIGHEST_PROTOCOL)
+                batch = []
+                for form in read_forms(source):
+                    batch.append(form)
+                    yield form
+                    if len(batch) == CACHE_BATCH:
+                        pickle.dump(batch, cache, pickle.HIGHEST_PROTOCOL)
+                        batch = []
+                pickle.dump(batch, cache, pickle.HIGHEST_PROTOCOL)
+            try:
+                os.replace(cache.name, cache_name)
+                is_complete = True
+            except OSError:
+                pass  # cache of another user is in the way
+        finally:
+            if not is_complete:
+                os.unlink(cache.name)
+
+
+_SYMBOL_CHAR = r"""[^\s\[\]{}('"`,;)]"""
+# every match is one token with leading whitespace and comments; the empty
+# alternative matches trailing whitespace and comments only
+_TOKEN_REGEX = re.compile(rf"""
+    (?:[\s,]|;[^\n]*)*
+    (~@|[\[\]{{}}()'`~^@]|"(?:\\.|[^\\"])*"?|{_SYMBOL_CHAR}+|)
+""", re.VERBOSE)
+_TERMINATED_STRING = re.compile(r'"(?:\\.|[^\\"])*"\Z')
+_VALID_STRING = re.compile(r'"(?:\\[\\"n]|[^\\"])*"\Z')
+_NUMBER = re.compile(r'-?\d+(?:\.\d*)?\Z')
+
+
 def tokenize(arg):
-    regex_str = r"""[\s,]*(~@|[\[\]{}()'`~^@]|"(?:\\.|[^\\"])*"?|;.*|[^\s\[\]{}('"`,;)]*)"""  # noqa
-    token_regex = re.compile(regex_str)
-    return [match.strip() for match in token_regex.findall(arg)]
+    """
+    Split mal source into tokens with one pass of the regex engine.
+    """
+    return _find_tokens(arg, len(arg))
+
+
+def _find_tokens(buffer, end):
+    tokens = _TOKEN_REGEX.findall(buffer, 0, end)
+    # trailing whitespace and comments match as up to two empty tokens
+    while tokens and not tokens[-1]:
+        tokens.pop()
+    return tokens
+
+
+def tokenize_chunks(chunks):
+    """
+    Tokenize source split into chunks. Buffer is tokenized up to its last
+    newline, only a string can continue past it, so an unterminated string
+    at the cut is scanned again after the next chunk is appended.
+    """
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        cut = buffer.rfind('\n') + 1
+        if not cut:
+            continue
+        tokens = _find_tokens(buffer, cut)
+        if tokens and tokens[-1][0] == '"' and not _TERMINATED_STRING.match(tokens[-1]):
+            cut -= len(tokens.pop())
+        buffer = buffer[cut:]
+        yield from tokens
+    yield from tokenize(buffer)
+
+
+_MACRO_SYMBOLS = {
+    '@': make_symbol('deref'),
+    '\'': make_symbol('quote'),
+    '`': make_symbol('quasiquote'),
+    '~': make_symbol('unquote'),
+    '~@': make_symbol('splice-unquote'),
+}
+
+
+_COLLECTIONS = {
+    '(': (make_list, ')'),
+    '[': (make_vector, ']'),
+    '{': (make_hashmap, '}'),
+}
 
 
 def read_form(reader):
-    curr_token = reader.peek()
-    if curr_token in tuple('([{'):
-        token_to_type = {
-            '(': make_list,
-            '[': make_vector,
-            '{': make_hashmap,
-        }
-        sequential = token_to_type[curr_token]
-        return read_list(reader, sequential)
-    elif curr_token == '@':
-        reader.next()
-        return make_list([make_symbol('deref'), read_form(reader)])
-    elif curr_token == '\'':
-        reader.next()
-        return make_list([make_symbol('quote'), read_form(reader)])
-    elif curr_token == '`':
-        reader.next()
-        return make_list([make_symbol('quasiquote'), read_form(reader)])
-    elif curr_token == '~':
-        reader.next()
-        return make_list([make_symbol('unquote'), read_form(reader)])
-    elif curr_token == '~@':
-        reader.next()
-        return make_list([make_symbol('splice-unquote'), read_form(reader)])
-    elif curr_token == '^':
-        reader.next()
+    token = reader.next()
+    if token in _COLLECTIONS:
+        sequential, closing_symbol = _COLLECTIONS[token]
+        return read_list(reader, sequential, closing_symbol)
+    elif token in _MACRO_SYMBOLS:
+        return make_list([_MACRO_SYMBOLS[token], read_form(reader)])
+    elif token == '^':
         term2 = read_form(reader)
         term1 = read_form(reader)
         return make_list([make_symbol('with-meta'), term1, term2])
-    return read_atom(reader)
+    elif token in _CLOSING_SYMBOLS:
+        raise MalException(f'Unexpected \'{token}\'')
+    return read_atom(token)
 
 
-def read_list(reader, sequential):
+def read_list(reader, sequential, closing_symbol):
     list_ = []
-    closing_symbol = {
-        '(': ')',
-        '[': ']',
-        '{': '}',
-    }[reader.next()]
     while True:
-        token = reader.peek()
-        if token == closing_symbol:
+        if reader.peek() == closing_symbol:
             reader.next()
             return sequential(list_)
         list_.append(read_form(reader))
 
 
-def valid_string(token):
-    transformed = token.replace('\\\\', '').replace('\\n', '').replace('\\"', '')
-    return (
-        transformed.startswith('"')
-        and transformed.endswith('"')
-        and len(transformed) != 1
-        and '\\' not in transformed
-    )
+_CONSTANTS = {'nil': NIL, 'true': TRUE, 'false': FALSE}
+_CLOSING_SYMBOLS = {')', ']', '}'}
 
 
-def read_atom(reader):
-    token = reader.next()
-    if token == 'nil':
-        return NIL
-    elif token == 'true':
-        return TRUE
-    elif token == 'false':
-        return FALSE
-    elif re.match(r'-?\d+\.*\d*', token):
-        return make_number(token)
-    elif token.startswith('"'):
-        if not valid_string(token):
+def read_atom(token):
+    first = token[0]
+    if first == '"':
+        if not _VALID_STRING.match(token):
             raise MalException('EOF')
         return make_string(token)
-    elif token.startswith(':'):
+    elif first == ':':
         return make_keyword(token)
-    elif re.match(r'.*', token):
-        return make_symbol(token)
-    raise MalException('Input/output error')
+    elif token in _CONSTANTS:
+        return _CONSTANTS[token]
+    elif first in '-0123456789' and _NUMBER.match(token):
+        return float(token) if '.' in token else int(token)
+    return make_symbol(token)
@@ -1,40 +1,32 @@
-import argparse
-import mal_readline  # noqa: side effect import
-from reader import read_str
+import atexit
+import io
+import os
+import pickle
+import sys
+import threading
+from contextvars import ContextVar
+from functools import partial
+from reader import read_str, read_file, read_forms
 from printer import pr_str
 from mal_types import (
     is_vector, make_vector,
     is_hashmap, make_hashmap_from_pydict, items,
     is_list, make_list, is_empty,
     is_symbol, make_symbol,
-    first, rest, FALSE, is_nil, is_bool,
-    make_function, is_mal_function, NIL, is_iterable,
-    MalException,
+    first, rest, FALSE, is_nil,
+    function, make_function, is_mal_function, NIL, is_iterable, values,
+    make_keyword, get, make_lazy_seq, MalException,
+    MalList, is_lazy_seq, make_future, is_string,
 )
-from env import Env
-from core import namespace
+from env import GlobalEnv, Frame, UNBOUND, VARIADIC_ASSIGNMENT_SYMBOL
+from core import namespace, resolve_path, working_directory
 
 # setup env step 1
-repl_env = Env()
+repl_env = GlobalEnv()
 for symbol, value in namespace.items():
     repl_env.set(symbol, value)
 
 
-def eval_ast(ast, env):
-    if is_vector(ast):
-        return make_vector(EVAL(elem, env) for elem in ast)
-    if is_hashmap(ast):
-        return make_hashmap_from_pydict(
-            {key: EVAL(value, env) for key, value in items(ast)}
-        )
-    if is_symbol(ast):
-        return env.get(ast)
-    elif is_list(ast):
-        return make_list(EVAL(elem, env) for elem in ast)
-    else:
-        return ast
-
-
 def READ(str_):
     """
     Make mal instructions from string.
@@ -46,130 +38,646 @@ def EVAL(ast, env):
     """
     Evaluate set of mal instructions.
     """
+    scope = Scope(env)
+    scope.form = ast
+    return analyze(ast, scope)(env)
+
+
+# Analysis turns a form into a tree of python closures `node(env) -> value`.
+# Special forms are resolved, macros expanded and constants built once, so
+# calling a function runs its pre-analyzed body instead of re-walking the ast.
+FN = make_symbol('fn*')
+DO = make_symbol('do')
+QUOTE = make_symbol('quote')
+UNQUOTE = make_symbol('unquote')
+SPLICE_UNQUOTE = make_symbol('splice-unquote')
+CONS = make_symbol('cons')
+CONCAT = make_symbol('concat')
+VEC = make_symbol('vec')
+NEW_SCOPE_FORMS = {FN, QUOTE, make_symbol('let*'), make_symbol('loop*'), make_symbol('quasiquote'), make_symbol('catch*')}
+WITH_META = make_symbol('with-meta')
+APPLY = make_symbol('apply')
+CACHE_KEYWORD = make_keyword('cache')
+DEFINITION_FORMS = {make_symbol('def!'), make_symbol('defmacro!')}
+
+# symbol -> analyzer(ast, scope, tail), that returns node.
+# tail is False, True for tail position of function body (calls may be
+# returned as TailCall) or LOOP_TAIL for tail position of loop* body, that
+# is not in function tail position (only recur is allowed there).
+special_forms = {}
+LOOP_TAIL = 'loop'
+RECUR = object()  # returned by recur, that rebinds loop variables in place
+
+
+def special_form(name):
+    """
+    Register analyzer of special form. Host code can use it to add new forms.
+    """
+    def register(analyzer):
+        special_forms[make_symbol(name)] = analyzer
+        return analyzer
+    return register
+
+
+class Scope:
+    """
+    Compile-time view of the environment. Each fn*/let*/catch* scope maps
+    its local names to slots of the runtime Frame, root scope holds the
+    global environment (used for def! and macros).
+    """
+    def __init__(self, env, names=(), outer=None):
+        self.env = env
+        self.outer = outer
+        self.recur_target = outer.recur_target if outer is not None else None
+        self.slots = {}
+        self.size = 0
+        self.defined = set()  # slots assigned by def!, they can be unbound
+        self.form = None  # top-level form, analyzed in the root scope
+        self.redefined = None
+        for name in names:
+            self.declare(name)
+
+    def declare(self, name):
+        self.slots[name] = self.size
+        self.size += 1
+        return self.size - 1
+
+    def define(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.declare(name)
+            self.defined.add(slot)
+        return slot
+
+    def may_redefine(self, name):
+        """
+        Whether evaluation of the top-level form can def! name.
+        """
+        scope = self
+        while scope.outer is not None:
+            scope = scope.outer
+        if scope.redefined is None:
+            scope.redefined = definitions_of(scope.form)
+        return name in scope.redefined
+
+    def resolve(self, name):
+        """
+        Return (depth, slot, defined) address of local name or None for global.
+        """
+        depth, scope = 0, self
+        while scope.outer is not None:
+            slot = scope.slots.get(name)
+            if slot is not None:
+                return depth, slot, slot in scope.defined
+            scope = scope.outer
+            depth += 1
+        return None
+
+
+class RecurTarget:
+    """
+    Body of loop* or fn*, that recur jumps to. `captured` is set when the
+    body creates closures: then recur rebinds variables in a fresh frame, so
+    closures from previous iterations keep their values.
+    """
+    def __init__(self, scope, slots):
+        self.scope = scope
+        self.slots = slots
+        self.used = False
+        self.captured = False
+
+
+def declare_definitions(ast, scope):
+    """
+    Reserve slots for names, that are def!-ined in the scope, so they can be
+    referenced before definition (recursive and mutually recursive functions).
+    """
+    if is_vector(ast):
+        for elem in ast:
+            declare_definitions(elem, scope)
+    elif is_hashmap(ast):
+        for elem in values(ast):
+            declare_definitions(elem, scope)
+    elif is_list(ast) and not is_empty(ast):
+        head = first(ast)
+        if is_symbol(head) and head in NEW_SCOPE_FORMS:
+            return
+        if is_symbol(head) and head in DEFINITION_FORMS and is_symbol(first(rest(ast))):
+            scope.define(ast[1])
+        for elem in ast:
+            declare_definitions(elem, scope)
+
+
+def definitions_of(ast):
+    """
+    Names, that def! or defmacro! anywhere in the form bind.
+    """
+    names, pending = set(), [ast]
+    while pending:
+        ast = pending.pop()
+        if is_vector(ast):
+            pending.extend(ast)
+        elif is_hashmap(ast):
+            pending.extend(values(ast))
+        elif is_list(ast) and not is_empty(ast):
+            head = first(ast)
+            if is_symbol(head) and head == QUOTE:
+                continue
+            if is_symbol(head) and head in DEFINITION_FORMS and is_symbol(first(rest(ast))):
+                names.add(ast[1])
+            pending.extend(ast)
+    return names
+
+
+class TailCall:
+    """
+    Call of mal function in tail position, that is performed by `invoke`.
+    """
+    __slots__ = ['fn', 'args']
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+
+def invoke(fn, args):
     while True:
-        if not is_list(ast):
-            return eval_ast(ast, env)
-        elif is_empty(ast):
-            return ast
+        result = fn.body(fn.env, args)
+        if type(result) is not TailCall:
+            return result
+        fn, args = result.fn, result.args
 
-        else:
-            ast = macroexpand(ast, env)
-            if not is_list(ast):
-                return eval_ast(ast, env)
-            elif not ast:
-                return ast
 
-        if first(ast) == make_symbol('def!'):
-            try:
-                operands = rest(ast)
-                symbol = first(operands)
-                value = EVAL(first(rest(operands)), env)
-            except ValueError:
-                raise RuntimeError('def! syntax is (def! /symbol/ /value/)')
-            if is_nil(value):
-                return env.get(symbol)
-            env.set(symbol, value)
+def not_found(symbol):
+    return RuntimeError(f"\"'{str(symbol, encoding='utf-8')}' not found\"")
+
+
+def unbound_global(global_env, symbol):
+    """
+    Value of global, that was unbound when analyzed. It may have been
+    defined since, also by outer of a child environment.
+    """
+    value = global_env.cell(symbol).value
+    if value is UNBOUND:
+        raise not_found(symbol)
+    return value
+
+
+def analyze(ast, scope, tail=False):
+    if is_symbol(ast):
+        return analyze_symbol(ast, scope)
+    if is_vector(ast):
+        nodes = [analyze(elem, scope) for elem in ast]
+        return lambda env: make_vector([node(env) for node in nodes])
+    if is_hashmap(ast):
+        nodes = [(key, analyze(value, scope)) for key, value in items(ast)]
+        return lambda env: make_hashmap_from_pydict(
+            {key: node(env) for key, node in nodes}
+        )
+    if not is_list(ast) or is_empty(ast):
+        return lambda env: ast
+
+    head = first(ast)
+    if is_symbol(head):
+        analyzer = special_forms.get(head)
+        if analyzer is not None:
+            return analyzer(ast, scope, tail)
+        if scope.resolve(head) is None and is_macro_call(ast, scope.env):
+            return analyze_macro_call(ast, scope, tail)
+    return analyze_application(ast, scope, tail)
+
+
+def analyze_symbol(symbol, scope):
+    address = scope.resolve(symbol)
+    if address is None:
+        global_env = scope.env
+        cell = global_env.cell(symbol)
+
+        def lookup_global(env):
+            value = cell.value
+            if value is UNBOUND:
+                value = unbound_global(global_env, symbol)
             return value
+        return lookup_global
+    depth, slot, defined = address
+    if defined:
+        defining_scope = scope
+        for _ in range(depth):
+            defining_scope = defining_scope.outer
+        # until def! runs, symbol means what it means outside of the scope
+        lookup_outside = analyze_symbol(symbol, defining_scope.outer)
 
-        elif first(ast) == make_symbol('let*'):
-            let_error = RuntimeError('let* syntax is (let* /list_of definitions/ /list_of_instructions/)')  # noqa
-            new_env = Env(env)
-            try:
-                operands = rest(ast)
-                definitions, instructions = operands
-            except Exception:
-                raise let_error
-            if len(definitions) % 2 != 0:
-                raise let_error
-            symbol_value_pairs = list(zip(
-                definitions[0::2],
-                definitions[1::2],
-            ))
-            for symb, value in symbol_value_pairs:
-                new_env.set(symb, EVAL(value, new_env))
-            ast = instructions
-            env = new_env
-            continue
-
-        elif first(ast) == make_symbol('if'):
-            elements = rest(ast)
-            condition = first(elements)
-            true_branch = first(rest(elements))
-            false_branch = first(rest(rest(elements)))
-            condition = EVAL(condition, env)
-            # empty lists, strings and 0 are 'truthy', only false and nil are 'falsy'
-            if is_nil(condition) or is_bool(condition) and condition == FALSE:
-                ast = false_branch
-            else:
-                ast = true_branch
-            continue
-
-        elif first(ast) == make_symbol('fn*'):
-            try:
-                op, binds, body = ast
-            except ValueError:
-                raise RuntimeError('fn* syntax us (fn* /arguments/ /function_body/)')  # noqa
-
-            def closure(*arguments):
-                try:
-                    new_env = Env(outer=env, binds=binds, exprs=arguments)
-                except ValueError:
-                    raise RuntimeError(
-                        'Error: function is called with wrong number of parameters'
-                        f'expected: {len(binds)}, actual: {len(arguments)}'
-                    )
-                return EVAL(body, new_env)
-
-            return make_function(body, binds, env, closure)
-
-        elif first(ast) == make_symbol('do'):
-            op, *exprs = ast
-            for expr in exprs[:-1]:
-                EVAL(expr, env)
-            ast = exprs[-1]
-            continue
-
-        # quoting element
-        elif ast[0] == make_symbol('quote'):
-            return ast[1]
+        def lookup_defined(env):
+            for _ in range(depth):
+                env = env.outer
+            value = env[slot] if slot < len(env) else UNBOUND
+            if value is UNBOUND:
+                return lookup_outside(env.outer)
+            return value
+        return lookup_defined
+    if depth == 0:
+        return lambda env: env[slot]
+    if depth == 1:
+        return lambda env: env.outer[slot]
+    if depth == 2:
+        return lambda env: env.outer.outer[slot]
 
-        elif ast[0] == make_symbol('quasiquote'):
-            ast = quasiquote(ast[1])
-            continue
+    def lookup(env):
+        for _ in range(depth):
+            env = env.outer
+        return env[slot]
+    return lookup
 
-        elif ast[0] == make_symbol('defmacro!'):
-            try:
-                op, symbol, operation_ast = ast
-                fn_sym, binds, body = operation_ast
-                if fn_sym != make_symbol('fn*'):
-                    raise ValueError
-            except ValueError:
-                raise RuntimeError('defmacro! syntax is (def! /symbol/ /function_body/)')
-            fn = make_function(body, binds, env, None, True)  # fn.fn is set to None. Check in step 9 is it ok
-            env.set(symbol, fn)
-            return NIL
-
-        elif ast[0] == make_symbol('macroexpand'):
-            return macroexpand(ast[1], env)
-
-        elif ast[0] == make_symbol('try*'):
-            try:
-                op, try_branch, catch = ast
-            except ValueError:
-                op, try_branch = ast
-                return EVAL(try_branch, env)
-            try:
-                return EVAL(try_branch, env)
-            except Exception as exc:
-                catch_symbol, exception_symbol, catch_branch = catch
-                return EVAL(catch_branch, Env(env, [exception_symbol], [exc]))
 
-        func, *args = eval_ast(ast, env)
-        if not is_mal_function(func):
+def analyze_assignment(symbol, scope):
+    """
+    Make setter(env, value), that binds symbol in the current scope.
+    """
+    if scope.outer is None:
+        global_env = scope.env
+        return lambda env, value: global_env.set(symbol, value)
+    slot = scope.define(symbol)
+
+    def assign(env, value):
+        if slot >= len(env):
+            # scope got new definitions after frame was created
+            env.extend([UNBOUND] * (slot + 1 - len(env)))
+        env[slot] = value
+    return assign
+
+
+def make_frame(outer, size):
+    frame = Frame([UNBOUND] * size)
+    frame.outer = outer
+    return frame
+
+
+def analyze_macro_call(ast, scope, tail):
+    """
+    Expand macro call once, when it's analyzed. The expansion is used while
+    the symbol is bound to the same macro, after rebinding the call is
+    expanded (or analyzed as a function call) again. If the top-level form
+    can redefine the macro, it's expanded when the call is evaluated first.
+    Macros with metadata {:cache false} are expanded every time.
+    """
+    head = first(ast)
+    macro = scope.env.lookup(head)
+    expansion = None
+    if is_cached_macro(macro) and not scope.may_redefine(head):
+        expansion = macro, analyze(expand(macro, ast), scope, tail)
+
+    def macro_call(env):
+        nonlocal expansion
+        value = scope.env.lookup(head)
+        if expansion is None or expansion[0] is not value:
+            node = analyze(macroexpand(ast, scope.env), scope, tail)
+            if is_mal_function(value) and value.is_macro and not is_cached_macro(value):
+                return node(env)
+            expansion = value, node
+        return expansion[1](env)
+    return macro_call
+
+
+@special_form('def!')
+def analyze_def(ast, scope, tail):
+    try:
+        operands = rest(ast)
+        symbol = first(operands)
+        assign = analyze_assignment(symbol, scope)
+        value_node = analyze(first(rest(operands)), scope)
+    except ValueError:
+        raise RuntimeError('def! syntax is (def! /symbol/ /value/)')
+    lookup = analyze_symbol(symbol, scope)
+
+    def def_(env):
+        value = value_node(env)
+        if is_nil(value):
+            return lookup(env)
+        assign(env, value)
+        return value
+    return def_
+
+
+@special_form('let*')
+def analyze_let(ast, scope, tail):
+    let_error = RuntimeError('let* syntax is (let* /list_of definitions/ /list_of_instructions/)')  # noqa
+    try:
+        operands = rest(ast)
+        definitions, instructions = operands
+    except Exception:
+        raise let_error
+    if len(definitions) % 2 != 0:
+        raise let_error
+    let_scope = Scope(scope.env, outer=scope)
+    declare_definitions(definitions[1::2], let_scope)
+    declare_definitions(instructions, let_scope)
+    bindings = []
+    for symbol, value in zip(definitions[0::2], definitions[1::2]):
+        node = analyze(value, let_scope)
+        bindings.append((let_scope.declare(symbol), node))
+    body = analyze(instructions, let_scope, tail)
+    size = let_scope.size
+
+    def let(env):
+        frame = make_frame(env, size)
+        for slot, node in bindings:
+            frame[slot] = node(frame)
+        return body(frame)
+    return let
+
+
+@special_form('if')
+def analyze_if(ast, scope, tail):
+    elements = rest(ast)
+    condition = analyze(first(elements), scope)
+    true_branch = analyze(first(rest(elements)), scope, tail)
+    false_branch = analyze(first(rest(rest(elements))), scope, tail)
+
+    def if_(env):
+        value = condition(env)
+        # empty lists, strings and 0 are 'truthy', only false and nil are 'falsy'
+        if value is NIL or value is FALSE:
+            return false_branch(env)
+        return true_branch(env)
+    return if_
+
+
+@special_form('fn*')
+def analyze_fn(ast, scope, tail):
+    try:
+        op, binds, body = ast
+    except ValueError:
+        raise RuntimeError('fn* syntax us (fn* /arguments/ /function_body/)')  # noqa
+    variadic = VARIADIC_ASSIGNMENT_SYMBOL in binds
+    names = [name for name in binds if name != VARIADIC_ASSIGNMENT_SYMBOL]
+    arity = len(names) - 1 if variadic else len(names)
+    if scope.recur_target is not None:
+        scope.recur_target.captured = True
+    fn_scope = Scope(scope.env, names, scope)
+    fn_scope.recur_target = target = RecurTarget(fn_scope, list(range(len(names))))
+    declare_definitions(body, fn_scope)
+    body_node = analyze(body, fn_scope, tail=True)
+    if target.used:
+        body_node = make_loop(body_node)
+    padding = [UNBOUND] * (fn_scope.size - len(names))
+    layout = scope_layout(scope)
+
+    def run(outer, args):
+        if len(args) != arity and not (variadic and len(args) > arity):
+            raise RuntimeError(
+                'Error: function is called with wrong number of parameters'
+                f'expected: {len(binds)}, actual: {len(args)}'
+            )
+        if variadic:
+            frame = Frame(args[:arity])
+            frame.append(make_list(args[arity:]))
+        else:
+            frame = Frame(args)
+        if padding:
+            frame.extend(padding)
+        frame.outer = outer
+        return body_node(frame)
+
+    def fn(env):
+        mal_fn = make_function(body, binds, env, None, body=run)
+        mal_fn.fn = lambda *arguments: invoke(mal_fn, arguments)
+        mal_fn.layout = layout
+        return mal_fn
+    return fn
+
+
+def scope_layout(scope):
+    """
+    Snapshot of local names visible from scope, innermost first, as
+    (slots, defined) pairs. It is enough to analyze a function body
+    again in another process.
+    """
+    layout = []
+    while scope.outer is not None:
+        layout.append((dict(scope.slots), frozenset(scope.defined)))
+        scope = scope.outer
+    return tuple(layout)
+
+
+@special_form('loop*')
+def analyze_loop(ast, scope, tail):
+    loop_error = RuntimeError('loop* syntax is (loop* /list_of definitions/ /instructions/)')  # noqa
+    try:
+        op, definitions, *instructions = ast
+    except ValueError:
+        raise loop_error
+    if len(definitions) % 2 != 0 or not instructions:
+        raise loop_error
+    loop_scope = Scope(scope.env, outer=scope)
+    declare_definitions(definitions[1::2], loop_scope)
+    declare_definitions(make_list(instructions), loop_scope)
+    bindings = []
+    for symbol, value in zip(definitions[0::2], definitions[1::2]):
+        node = analyze(value, loop_scope)
+        bindings.append((loop_scope.declare(symbol), node))
+    loop_scope.recur_target = RecurTarget(loop_scope, [slot for slot, node in bindings])
+    body = make_loop(analyze_do(make_list([DO, *instructions]), loop_scope, tail or LOOP_TAIL))
+    size = loop_scope.size
+
+    def loop(env):
+        frame = make_frame(env, size)
+        for slot, node in bindings:
+            frame[slot] = node(frame)
+        return body(frame)
+    return loop
+
+
+def make_loop(body):
+    def loop(frame):
+        while True:
+            result = body(frame)
+            if result is RECUR:
+                continue
+            if type(result) is Frame:
+                # recur created fresh frame for captured loop variables
+                frame = result
+                continue
+            return result
+    return loop
+
+
+@special_form('recur')
+def analyze_recur(ast, scope, tail):
+    target = scope.recur_target
+    if target is None or not tail:
+        raise RuntimeError('recur can be used only in tail position of loop* or fn*')
+    arg_nodes = [analyze(elem, scope) for elem in rest(ast)]
+    if len(arg_nodes) != len(target.slots):
+        raise RuntimeError(
+            f'recur expects {len(target.slots)} arguments, got {len(arg_nodes)}'
+        )
+    target.used = True
+    depth, target_scope = 0, scope
+    while target_scope is not target.scope:
+        target_scope = target_scope.outer
+        depth += 1
+    slots = target.slots
+
+    def recur(env):
+        values = [node(env) for node in arg_nodes]
+        for _ in range(depth):
+            env = env.outer
+        if target.captured:
+            outer, env = env.outer, Frame(env)
+            env.outer = outer
+        for slot, value in zip(slots, values):
+            env[slot] = value
+        return env if target.captured else RECUR
+    return recur
+
+
+@special_form('do')
+def analyze_do(ast, scope, tail):
+    op, *exprs = ast
+    nodes = [analyze(expr, scope) for expr in exprs[:-1]]
+    last = analyze(exprs[-1], scope, tail)
+
+    def do(env):
+        for node in nodes:
+            node(env)
+        return last(env)
+    return do
+
+
+@special_form('defmacro!')
+def analyze_defmacro(ast, scope, tail):
+    try:
+        op, symbol, operation_ast = ast
+        meta_node = None
+        if first(operation_ast) == WITH_META:
+            # (defmacro! name ^{:cache false} (fn* ...))
+            op, operation_ast, meta_ast = operation_ast
+            meta_node = analyze(meta_ast, scope)
+        fn_sym, binds, body = operation_ast
+        if fn_sym != FN:
+            raise ValueError
+    except ValueError:
+        raise RuntimeError('defmacro! syntax is (def! /symbol/ /function_body/)')
+    assign = analyze_assignment(symbol, scope)
+    fn_node = analyze_fn(operation_ast, scope, False)
+
+    def defmacro(env):
+        macro = fn_node(env)
+        macro.is_macro = True
+        if meta_node is not None:
+            macro.meta = meta_node(env)
+        assign(env, macro)
+        return NIL
+    return defmacro
+
+
+@special_form('quote')
+def analyze_quote(ast, scope, tail):
+    quoted = ast[1]
+    return lambda env: quoted
+
+
+@special_form('quasiquote')
+def analyze_quasiquote(ast, scope, tail):
+    return analyze(quasiquote(ast[1]), scope, tail)
+
+
+@special_form('macroexpand')
+def analyze_macroexpand(ast, scope, tail):
+    form = ast[1]
+    global_env = scope.env
+    return lambda env: macroexpand(form, global_env)
+
+
+@special_form('lazy-seq')
+def analyze_lazy_seq(ast, scope, tail):
+    if len(ast) == 1:
+        return lambda env: make_lazy_seq(lambda: NIL)
+    body = analyze_do(ast, scope, False)
+    return lambda env: make_lazy_seq(lambda: body(env))
+
+
+@special_form('try*')
+def analyze_try(ast, scope, tail):
+    try:
+        op, try_branch, catch = ast
+    except ValueError:
+        op, try_branch = ast
+        return analyze(try_branch, scope)
+    try_node = analyze(try_branch, scope)
+    catch_symbol, exception_symbol, catch_branch = catch
+    catch_scope = Scope(scope.env, [exception_symbol], scope)
+    declare_definitions(catch_branch, catch_scope)
+    catch_node = analyze(catch_branch, catch_scope, tail)
+    size = catch_scope.size
+
+    def try_(env):
+        try:
+            return try_node(env)
+        except Exception as exc:
+            frame = make_frame(env, size)
+            frame[0] = exc
+            return catch_node(frame)
+    return try_
+
+
+def analyze_application(ast, scope, tail):
+    head = first(ast)
+    fn_node, *arg_nodes = [analyze(elem, scope) for elem in ast]
+    global_env = scope.env
+    expansion = None  # (macro, node) for macros defined after analysis
+    cell = None
+    if is_symbol(head) and scope.resolve(head) is None:
+        # calls of globals read the cell directly
+        cell = global_env.cell(head)
+
+        def fn_node(env):
+            fn = cell.value
+            if fn is UNBOUND:
+                fn = unbound_global(global_env, head)
+            return fn
+
+    def application(env):
+        nonlocal expansion
+        fn = fn_node(env)
+        if not is_mal_function(fn):
             # core function
-            return func(*args)
-        ast = func.ast
-        env = Env(func.env, func.params, args)
+            if tail is True and fn is apply_:
+                return tail_apply(*[node(env) for node in arg_nodes])
+            return fn(*[node(env) for node in arg_nodes])
+        if fn.is_macro:
+            # macro is defined after the form was analyzed
+            if expansion is None or expansion[0] is not fn or not is_cached_macro(fn):
+                expansion = fn, analyze(expand(fn, ast), scope, tail)
+            return expansion[1](env)
+        args = [node(env) for node in arg_nodes]
+        if tail is True:
+            return TailCall(fn, args)
+        return invoke(fn, args)
+
+    # core functions with one or two arguments are called without
+    # building argument list
+    if cell is not None and tail is True and head == APPLY:
+        return application
+    if cell is not None and len(arg_nodes) == 1:
+        arg, = arg_nodes
+
+        def unary_global_application(env):
+            fn = cell.value
+            if fn is UNBOUND or type(fn) is function:
+                return application(env)
+            return fn(arg(env))
+        return unary_global_application
+    if cell is not None and len(arg_nodes) == 2:
+        arg1, arg2 = arg_nodes
+
+        def binary_global_application(env):
+            fn = cell.value
+            if fn is UNBOUND or type(fn) is function:
+                return application(env)
+            return fn(arg1(env), arg2(env))
+        return binary_global_application
+    return application
 
 
 def PRINT(mal_type):
@@ -179,48 +687,59 @@ def PRINT(mal_type):
     return pr_str(mal_type)
 
 
+# environment of Interpreter, that evaluates in this context: eval,
+# load-file, save-image and unpickled functions use it, also when called
+# by shared functions
+active_env = ContextVar('active_env', default=None)
+
+
+def current_env():
+    return active_env.get() or repl_env
+
+
 def eval_(ast):
-    return EVAL(ast, repl_env)
+    return EVAL(ast, current_env())
 
 
 def quasiquote(ast):
     if is_list(ast):
         if is_empty(ast):
             return ast
-        if ast[0] == make_symbol('unquote'):
+        if ast[0] == UNQUOTE:
             return ast[1]
         else:
-            processed = []
-            for elt in ast[::-1]:
-                if is_list(elt) and not is_empty(elt) and elt[0] == make_symbol('splice-unquote'):
-                    processed = make_list([make_symbol('concat'), elt[1], processed])
+            processed = make_list([])
+            for elt in reversed(ast):
+                if is_list(elt) and not is_empty(elt) and elt[0] == SPLICE_UNQUOTE:
+                    processed = make_list([CONCAT, elt[1], processed])
                 else:
-                    processed = make_list([make_symbol('cons'), quasiquote(elt), processed])
+                    processed = make_list([CONS, quasiquote(elt), processed])
             return make_list(processed)
     elif is_vector(ast):
-        return make_list([make_symbol('vec'), *ast])
+        return make_list([VEC, *ast])
     elif is_symbol(ast) or is_hashmap(ast):
-        return make_list([make_symbol('quote'), ast])
+        return make_list([QUOTE, ast])
     return ast
 
 
 def is_macro_call(ast, env):
-    try:
-        return (
-            is_list(ast)
-            and is_symbol(ast[0])
-            and env.get(ast[0]).is_macro
-        )  # function, that is macros
-    except (AttributeError, RuntimeError):
+    if not is_list(ast) or is_empty(ast) or not is_symbol(ast[0]):
         return False
+    value = env.lookup(ast[0])
+    return is_mal_function(value) and value.is_macro
+
+
+def is_cached_macro(macro):
+    return get(macro.meta, CACHE_KEYWORD) is not FALSE
+
+
+def expand(macro, ast):
+    return invoke(macro, make_list(rest(ast)))
 
 
 def macroexpand(ast, env):
     while is_macro_call(ast, env):
-        fn_name, *arguments = ast
-        macro_fn = env.get(fn_name)
-        new_env = Env(macro_fn.env, macro_fn.params, make_list(arguments))
-        ast = EVAL(macro_fn.ast, new_env)
+        ast = expand(env.lookup(ast[0]), ast)
     return ast
 
 
@@ -228,10 +747,18 @@ def throw(exc):
     raise MalException(exc)
 
 
-def mal_map(fn, mal_iter):
+def call(fn, args):
+    """
+    Call mal or core function from python code, mal functions run in the
+    `invoke` trampoline, so their tail calls don't grow the stack.
+    """
     if is_mal_function(fn):
-        fn = fn.fn
-    return make_list(map(fn, mal_iter))
+        return invoke(fn, args)
+    return fn(*args)
+
+
+def mal_map(fn, mal_iter):
+    return make_list([call(fn, [elem]) for elem in mal_iter])
 
 
 def _flatten(args):
@@ -247,45 +774,481 @@ def _flatten(args):
 
 
 def apply_(fn, *args):
-    if is_mal_function(fn):
-        fn = fn.fn
-    args = _flatten(args)
-    return fn(*args)
+    return call(fn, list(_flatten(args)))
+
+
+def tail_apply(fn, *args):
+    """
+    `apply` in tail position: call of mal function is passed to trampoline.
+    """
+    if is_mal_function(fn) and not fn.is_macro:
+        return TailCall(fn, list(_flatten(args)))
+    return apply_(fn, *args)
+
+
+class MalPickler(pickle.Pickler):
+    """
+    Pickler for values sent to other interpreter processes. Builtins are
+    sent by their reserved ids, global environment itself as a reference
+    to the receiver's one. Mal functions are sent as their
+    source, captured frames and used globals and analyzed again on load,
+    because analyzed bodies are python closures.
+    """
+    def __init__(self, file):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+
+    def persistent_id(self, obj):
+        if callable(obj):
+            return _BUILTIN_IDS.get(id(obj))
+        return None
+
+    def reducer_override(self, obj):
+        if type(obj) is function:
+            if obj.layout is None:
+                raise pickle.PicklingError('function can not be pickled')
+            state = {
+                'ast': obj.ast,
+                'params': obj.params,
+                'layout': obj.layout,
+                'env': obj.env,
+                'is_macro': obj.is_macro,
+                'meta': obj.meta,
+                'globals': used_globals(obj),
+            }
+            return restore_function, (), state, None, None, set_function_state
+        if isinstance(obj, GlobalEnv):
+            return receiver_env, ()
+        if is_lazy_seq(obj):
+            return MalList, (list(obj),)
+        return NotImplemented
+
+
+class MalUnpickler(pickle.Unpickler):
+    """
+    Unpickler of MalPickler data. Functions are bound to `env`, the
+    active environment by default, and globals, that they were sent with,
+    are set there. With `replace_globals` false (results of tasks) only
+    missing globals are set, so the receiver's own bindings are not
+    replaced by copies.
+    """
+    def __init__(self, file, replace_globals=True, env=None):
+        super().__init__(file)
+        self.replace_globals = replace_globals
+        self.env = env or current_env()
+
+    def persistent_load(self, pid):
+        if pid not in _BUILTINS:
+            raise pickle.UnpicklingError(f'unknown builtin {pid!r}')
+        return _BUILTINS[pid]
+
+    def find_class(self, module, name):
+        # interpreter is run as a script, imported, or is a pool worker
+        if module in ('__main__', '__mp_main__', __name__):
+            if name == 'set_function_state':
+                return partial(
+                    set_function_state, env=self.env, replace_globals=self.replace_globals,
+                )
+            if name == 'receiver_env':
+                return lambda: self.env
+            return globals()[name]
+        return super().find_class(module, name)
+
+
+def dumps(value):
+    file = io.BytesIO()
+    MalPickler(file).dump(value)
+    return file.getvalue()
+
+
+def loads(data, replace_globals=True, env=None):
+    return MalUnpickler(io.BytesIO(data), replace_globals, env).load()
+
+
+def receiver_env():
+    """
+    Global environment, that a pickled function is bound to, is replaced
+    by the environment of the receiver.
+    """
+    return current_env()
+
+
+def used_globals(fn):
+    """
+    Global values, that body of fn refers to, except builtins, that are
+    still bound to their own names.
+    """
+    env = fn.env
+    while type(env) is Frame:
+        env = env.outer
+    used, pending = {}, [fn.ast]
+    while pending:
+        ast = pending.pop()
+        if is_symbol(ast):
+            value = env.lookup(ast, UNBOUND)
+            if value is not UNBOUND and value is not _BUILTINS.get(ast):
+                used[ast] = value
+        elif is_list(ast) or is_vector(ast):
+            pending.extend(ast)
+        elif is_hashmap(ast):
+            pending.extend(values(ast))
+    return used
+
+
+def restore_function():
+    return make_function(None, None, None, None)
+
+
+def set_function_state(fn, state, env, replace_globals=True):
+    for name, value in state['globals'].items():
+        if replace_globals or env.lookup(name, UNBOUND) is UNBOUND:
+            env.set(name, value)
+    fn.ast, fn.params, fn.env = state['ast'], state['params'], state['env']
+    fn.layout = state['layout']
+    fn.is_macro, fn.meta = state['is_macro'], state['meta']
+    fn.fn = lambda *arguments: invoke(fn, arguments)
+    # body is analyzed on first call, so unused functions of image cost
+    # nothing; copies of fn (with-meta) share the analyzed body
+    compiled = []
+
+    def lazy_body(frame, arguments):
+        if not compiled:
+            compiled.append(compile_body(fn, env))
+        return compiled[0](frame, arguments)
+    fn.body = lazy_body
+
+
+def compile_body(fn, env):
+    scope = Scope(env)
+    for slots, defined in reversed(fn.layout):
+        scope = Scope(env, outer=scope)
+        scope.slots = dict(slots)
+        scope.size = max(slots.values(), default=-1) + 1
+        scope.defined = set(defined)
+    node = analyze_fn(make_list([FN, fn.params, fn.ast]), scope, False)
+    fn.body = node(fn.env).body
+    return fn.body
+
+
+def run_task(payload):
+    """
+    Worker side of the pool: call function with each of argument lists
+    and pickle results (or error) back.
+    """
+    def run():
+        try:
+            fn, args_list = loads(payload)
+            return dumps((True, [call(fn, list(args)) for args in args_list]))
+        except Exception as error:
+            try:
+                return dumps((False, error))
+            except Exception:
+                return dumps((False, RuntimeError(str(error))))
+    return with_deep_stack(run)
+
+
+def task_result(payload, env=None):
+    is_ok, result = loads(payload, replace_globals=False, env=env)
+    if not is_ok:
+        raise result
+    return result
+
+
+class WorkerPool:
+    """
+    Process pool for pmap and futures, started on first use. Workers are
+    not forked from the interpreter, which already runs threads, but
+    started from a clean server process (or spawned): they bootstrap their
+    own environment and get functions with the globals they use.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._executor = None
+
+    def submit(self, fn, args_list):
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            method = 'forkserver'
+            if method not in multiprocessing.get_all_start_methods():
+                method = 'spawn'
+            context = multiprocessing.get_context(method)
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self._executor.submit(run_task, dumps((fn, args_list)))
+
+    def resize(self, workers):
+        self.shutdown()
+        self.workers = workers
+
+    def shutdown(self, cancel_futures=False):
+        """
+        Stop workers after running tasks, pending ones are run too unless
+        cancelled.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=cancel_futures)
+            self._executor = None
+
+
+worker_pool = WorkerPool(int(os.environ.get('MAL_WORKERS', 0)) or None)
+
+
+def pmap(fn, *collections):
+    args_list = list(zip(*collections))
+    if not args_list:
+        return make_list([])
+    workers = worker_pool.workers or os.cpu_count() or 1
+    size = -(-len(args_list) // (workers * 4))
+    tasks = [
+        worker_pool.submit(fn, args_list[start:start + size])
+        for start in range(0, len(args_list), size)
+    ]
+    return make_list([value for task in tasks for value in task_result(task.result())])
+
+
+def future_call(fn, *args):
+    task = worker_pool.submit(fn, [args])
+    env = current_env()  # deref may run in another context
+    decoded = []
+    lock = threading.Lock()
+
+    def result():
+        # decoded once, so every deref returns the same object
+        with lock:
+            if not decoded:
+                decoded.append(task_result(task.result(), env)[0])
+        return decoded[0]
+    return make_future(result)
+
+
+def set_workers(workers):
+    worker_pool.resize(workers)
+    return NIL
 
 
 def rep(arg):
     return PRINT(EVAL(READ(arg), repl_env))
 
 
+def load_file(filename, env=None):
+    """
+    Evaluate file form by form, without reading it whole.
+    """
+    env = env or current_env()
+    for form in read_file(resolve_path(filename)):
+        EVAL(form, env)
+    return NIL
+
+
+IMAGE_VERSION = 2
+
+
+def save_image(filename, env=None):
+    """
+    Write global mal definitions (functions, macros, atoms and other
+    values) to file. Builtins are written by reserved ids, so image is
+    valid only for interpreter of the same version.
+    """
+    env = env or current_env()
+    definitions = [
+        (name, value) for name, value in env.bindings()
+        if value is not _BUILTINS.get(name)
+    ]
+    with open(filename, 'wb') as file:
+        MalPickler(file).dump(('malimage', IMAGE_VERSION, definitions))
+    return NIL
+
+
+def load_image(filename, env=None):
+    """
+    Restore definitions written by `save-image`.
+    """
+    env = env or repl_env
+    with open(filename, 'rb') as file:
+        header, version, definitions = MalUnpickler(file, env=env).load()
+    if (header, version) != ('malimage', IMAGE_VERSION):
+        raise RuntimeError(f'{filename} is not a mal image of version {IMAGE_VERSION}')
+    for name, value in definitions:
+        env.set(name, value)
+    return NIL
+
+
+class Interpreter:
+    """
+    Interpreter for embedding into python programs. Its environment is a
+    child of the bootstrapped one (or of `parent` interpreter), so core
+    namespace is shared, and definitions stay in the interpreter. While
+    it evaluates, eval and load-file work in its environment.
+
+    Evaluation runs in the calling thread, use `with_deep_stack` for
+    deeply recursive programs.
+    """
+    def __init__(self, parent=None):
+        self.env = GlobalEnv(repl_env if parent is None else parent.env)
+
+    def _run(self, fn, *args):
+        token = active_env.set(self.env)
+        try:
+            return fn(*args)
+        finally:
+            active_env.reset(token)
+
+    def eval_string(self, source):
+        """
+        Evaluate all forms of source, return value of the last one.
+        """
+        def run():
+            result = NIL
+            for form in read_forms(source):
+                result = EVAL(form, self.env)
+            return result
+        return self._run(run)
+
+    def eval_form(self, form):
+        return self._run(EVAL, form, self.env)
+
+    def call(self, fn, *args):
+        """
+        Call mal function, or function defined in interpreter by name.
+        """
+        if is_string(fn):
+            fn = self.env.get(make_symbol(fn))
+        return self._run(call, fn, args)
+
+    def define(self, name, value):
+        self.env.set(make_symbol(name), value)
+
+    def lookup(self, name, default=NIL):
+        return self.env.lookup(make_symbol(name), default)
+
+    def fork(self):
+        """
+        Cheap copy: fork sees definitions of this interpreter, also their
+        later changes, until it redefines them.
+        """
+        return Interpreter(self)
+
+
+def eval_request(request):
+    """
+    Evaluate request of mal_server in a fresh child of the warm environment.
+    Relative file names are resolved against directory of the client.
+    """
+    interpreter = Interpreter()
+    interpreter.define('*ARGV*', make_list(request.get('argv', [])))
+    interpreter.define('*FILENAME*', request.get('filename', NIL))
+    working_directory.set(request.get('cwd'))  # context of request's thread
+    interpreter.eval_string(request['source'])
+
+
 # setup env step 2
 repl_env.set(make_symbol('eval'), eval_)
 rep("(def! not (fn* (a) (if a false true)))")
-rep("""(def! load-file (fn* (f) (eval (read-string (str "(do " (slurp f) "\nnil)")))))""")
+repl_env.set(make_symbol('load-file'), load_file)
 rep("""(defmacro! cond (fn* (& xs) (if (> (count xs) 0) (list 'if (first xs) (if (> (count xs) 1) (nth xs 1) (throw \"odd number of forms to cond\")) (cons 'cond (rest (rest xs)))))))""")  # noqa
 repl_env.set(make_symbol('apply'), apply_)
 repl_env.set(make_symbol('map'), mal_map)
 repl_env.set(make_symbol('throw'), throw)
+repl_env.set(make_symbol('pmap'), pmap)
+repl_env.set(make_symbol('future-call'), future_call)
+repl_env.set(make_symbol('set-workers!'), set_workers)
+repl_env.set(make_symbol('save-image'), save_image)
+rep("(defmacro! future (fn* (& body) `(future-call (fn* () (do ~@body)))))")
+rep("(defmacro! go (fn* (& body) `(go-call (fn* () (do ~@body)))))")
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--interactive', action='store_true')
-parser.add_argument('filename', nargs='?', help='Filename to be executed')
-parser.add_argument('prog_args', nargs='*', help='Arguments passed to program')
-parser.add_argument('--prompt', nargs='?', help='Prompt to show to user')
-parser.add_argument('--disable-header', action='store_true')
-args = parser.parse_args()
+# builtins are pickled by these reserved ids: names of the bootstrapped
+# environment, that stay valid when a program rebinds the names
+_BUILTINS = {
+    name: value for name, value in repl_env.bindings()
+    if callable(value) and not is_mal_function(value)
+}
+_BUILTIN_IDS = {id(value): name for name, value in _BUILTINS.items()}
 
 
-if __name__ == '__main__':
+STACK_SIZE = 512 * 1024 * 1024
+RECURSION_LIMIT = 200000
+
+
+_stack_size_lock = threading.Lock()
+
+
+def start_deep_thread(target):
+    """
+    Start daemon thread with big stack. Stack size is restored right after
+    start, so other threads (pools, event loop) keep the default one.
+    """
+    sys.setrecursionlimit(RECURSION_LIMIT)
+    with _stack_size_lock:
+        previous = threading.stack_size(STACK_SIZE)
+        try:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+        finally:
+            threading.stack_size(previous)
+    return thread
+
+
+def with_deep_stack(fn):
+    """
+    Run fn in a thread with big stack and recursion limit, so non-tail
+    recursion (e.g. through `map`) can go deep. Returns result of fn,
+    exception of fn is raised again in the calling thread.
+    """
+    outcome = []
+
+    def run():
+        try:
+            outcome.append((True, fn()))
+        except BaseException as error:
+            outcome.append((False, error))
+    thread = start_deep_thread(run)
+    # thread is a daemon, so KeyboardInterrupt in join stops the program
+    thread.join()
+    ok, value = outcome[0]
+    if not ok:
+        raise value
+    return value
+
+
+def parse_args(argv=None):
+    """
+    Command line options. Parsed only when run as a script, so the module
+    can be imported as a library.
+    """
+    import argparse
+    from mal_client import DEFAULT_SOCKET
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--interactive', action='store_true')
+    parser.add_argument('filename', nargs='?', help='Filename to be executed')
+    parser.add_argument('prog_args', nargs='*', help='Arguments passed to program')
+    parser.add_argument('--prompt', nargs='?', help='Prompt to show to user')
+    parser.add_argument('--disable-header', action='store_true')
+    parser.add_argument('--workers', type=int, help='Number of processes for pmap and future')
+    parser.add_argument('--image', help='Start with definitions saved by save-image')
+    parser.add_argument('--serve', action='store_true', help='Evaluate requests of mal_client.py')
+    parser.add_argument('--socket', help=f'Unix socket of server (default {DEFAULT_SOCKET})')
+    return parser.parse_args(argv)
+
+
+def main(args=None):
+    args = args or parse_args()
+    if args.workers:
+        worker_pool.resize(args.workers)
+    if args.image:
+        load_image(args.image)
+    if args.serve:
+        import mal_server
+        return mal_server.serve(eval_request, args.socket, start_deep_thread)
     arg_to_str = lambda arg: f'"{arg}"'
     rep(f'(def! *ARGV* {"(list " +  " ".join(arg_to_str(arg) for arg in args.prog_args) + ")" })')
     if args.filename is not None:
         rep(f'(def! *FILENAME* "{args.filename}")')
         rep('(load-file *FILENAME*)')
         if not args.interactive:
-            exit(0)
+            return
     else:
         if not args.disable_header:
             rep("""(println (str "Mal [" *host-language* "]"))""")
+    import mal_readline  # noqa: side effect import, history of interactive session
     while True:
         inp = input(args.prompt or 'user> ')
         try:
@@ -296,3 +1259,15 @@ if __name__ == '__main__':
             print("Error:", e)
         else:
             print(res)
+
+
+if __name__ == '__main__':
+    try:
+        with_deep_stack(main)
+    except KeyboardInterrupt:
+        # REPL thread blocked in input() keeps the lock of stdin, normal
+        # shutdown would abort on it: run exit handlers and leave at once
+        worker_pool.shutdown(cancel_futures=True)
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        os._exit(130)
@@ -0,0 +1,66 @@
+"""
+Isolation of Interpreter forks, also for values that come back from
+worker processes of pmap and future.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from mal_types import Keyword, make_symbol  # noqa: E402
+from stepA_mal import Interpreter, repl_env, worker_pool  # noqa: E402
+
+MISSING = object()
+
+
+class ForkIsolationTest(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        worker_pool.shutdown()
+
+    def make_tenants(self):
+        first, second = Interpreter(), Interpreter()
+        first.eval_string('(def! secret-helper (fn* [] :first))')
+        second.eval_string('(def! own-helper (fn* [] :second))')
+        return first, second
+
+    def assert_isolated(self, first, second):
+        self.assertIs(second.lookup('secret-helper', MISSING), MISSING)
+        self.assertIs(first.lookup('own-helper', MISSING), MISSING)
+        self.assertIs(repl_env.lookup(make_symbol('secret-helper'), MISSING), MISSING)
+        self.assertIs(repl_env.lookup(make_symbol('own-helper'), MISSING), MISSING)
+
+    def test_pmap_results_stay_in_their_fork(self):
+        first, second = self.make_tenants()
+        # returned functions carry the helper, that they use
+        first.eval_string('(def! fns (pmap (fn* [x] (fn* [] (secret-helper))) [1 2]))')
+        second.eval_string('(def! fns (pmap (fn* [x] (fn* [] (own-helper))) [1 2]))')
+        self.assertEqual(first.eval_string('(map (fn* [f] (f)) fns)'), [Keyword('first')] * 2)
+        self.assertEqual(second.eval_string('(map (fn* [f] (f)) fns)'), [Keyword('second')] * 2)
+        self.assert_isolated(first, second)
+
+    def test_future_results_stay_in_their_fork(self):
+        first, second = self.make_tenants()
+        first.eval_string('(def! f (future (fn* [] (secret-helper))))')
+        second.eval_string('(def! f (future (fn* [] (own-helper))))')
+        self.assertEqual(first.eval_string('(@f)'), Keyword('first'))
+        self.assertEqual(second.eval_string('(@f)'), Keyword('second'))
+        self.assert_isolated(first, second)
+
+    def test_fork_follows_outer_until_it_redefines(self):
+        base = Interpreter()
+        base.eval_string('(def! x 1) (def! getx (fn* [] x))')
+        fork = base.fork()
+        self.assertEqual(fork.eval_string('(list x (getx))'), [1, 1])
+        base.eval_string('(def! x 2)')
+        self.assertEqual(fork.eval_string('(list x (getx))'), [2, 2])
+        fork.eval_string('(def! x 3)')
+        self.assertEqual(fork.eval_string('x'), 3)
+        self.assertEqual(base.eval_string('x'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()